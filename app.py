@@ -1,36 +1,97 @@
-from flask import Flask, render_template, request, jsonify
+import time
+_import_start = time.perf_counter()
+
+from flask import Flask, render_template, request, jsonify, Response
 from flask_cors import CORS
 import utils.parser as parser
 import utils.evaluator as evaluator
-import numpy as np
-from sympy import symbols, Eq, solve, sympify
+from utils.cache import compile_expression, expression_cache
+import utils.batch as batch
+import utils.stream as stream
+import utils.worksheet as worksheet
+import utils.dag as dag
+from utils.scopes import DEFAULT_SCOPE, scope_store
+import utils.metrics as metrics
+import utils.lazy as lazy
 import re
 
+# numpy/sympy/mpmath-backed modules; loaded on first use with LAZY_IMPORTS=1
+vectorized = lazy.lazy_import('utils.vectorized')
+solver = lazy.lazy_import('utils.solver')
+compiler = lazy.lazy_import('utils.compiler')
+complex_ops = lazy.lazy_import('utils.complex_ops')
+plot_utils = lazy.lazy_import('utils.plot')
+numeric = lazy.lazy_import('utils.numeric')
+matrix = lazy.lazy_import('utils.matrix')
+matrix_store = lazy.lazy_import('utils.matrix_store', 'matrix_store')
+run_pipeline = lazy.lazy_import('utils.matrix_store', 'run_pipeline')
+store_result = lazy.lazy_import('utils.matrix_store', 'store_result')
+
 app = Flask(__name__, static_folder='static', template_folder='templates')
 CORS(app)
 
+@app.before_request
+def start_request_metrics():
+    metrics.begin_request(request.url_rule.rule if request.url_rule else 'unmatched')
+
+@app.after_request
+def finish_request_metrics(response):
+    metrics.end_request(request.method, response.status_code)
+    if lazy.LAZY_IMPORTS and lazy.PREWARM_IMPORTS:
+        lazy.prewarm()
+    return response
+
+def session_scope():
+    # Variables are scoped by the client's session token, if it sends one
+    scope_id = request.headers.get('X-Session-Id', '').strip()
+    return scope_id[:128] or DEFAULT_SCOPE
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def _evaluate_compiled(compiled, data, want_steps, scope):
+    # 'backend' picks the number type (see utils/numeric.py); plain float
+    # uses the constant-folded program (or its DAG) when no steps are wanted
+    backend = data.get('backend', 'float')
+    if backend == 'float':
+        if not want_steps:
+            with metrics.stage('evaluate'):
+                return dag.evaluate(compiled, scope), None
+        with metrics.stage('evaluate_trace'):
+            result, _, steps = evaluator.run_program(compiled['program'], trace=True, scope=scope)
+        return result, steps
+    precision = data.get('precision', numeric.DEFAULT_PRECISION)
+    with metrics.stage(f'evaluate_{backend}'):
+        return numeric.run_backend(compiled['program'], backend, precision, want_steps, scope)
+
+def _tree(compiled, data):
+    # 'tree': 'dag' sends the flat form with repeated subtrees listed once
+    return dag.tree_json(compiled) if data.get('tree') == 'dag' else compiled['tree']
+
 @app.route('/calculate', methods=['POST'])
 def calculate():
     data = request.get_json()
     expr = data.get('expression', '')
+    want_steps = bool(data.get('steps', True))
     try:
-        tokens = parser.tokenize(expr)
-        postfix, _ = parser.infix_to_postfix(tokens)
-        steps = evaluator.get_evaluation_steps(postfix)
-        result, _ = evaluator.evaluate_postfix(postfix)
-        tree = parser.build_expression_tree(postfix)
-        return jsonify({
+        compiled = compile_expression(expr)
+        scope = scope_store.snapshot(session_scope())
+        result, steps = _evaluate_compiled(compiled, data, want_steps, scope)
+        response = {
             'result': result,
-            'tokens': tokens,
-            'postfix': postfix,
-            'steps': steps,
-            'tree': tree
-        })
+            'tokens': compiled['tokens'],
+            'postfix': compiled['postfix'],
+            'steps': steps or [],
+            'tree': _tree(compiled, data)
+        }
+        if data.get('backend', 'float') != 'float':
+            response['result'] = numeric.format_result(result, data['backend'], data.get('precision', numeric.DEFAULT_PRECISION))
+            response['backend'] = data['backend']
+        with metrics.stage('serialize'):
+            return jsonify(response)
     except Exception as e:
+        metrics.record_error(e)
         return jsonify({
             'result': 'Error',
             'tokens': [],
@@ -39,29 +100,182 @@ def calculate():
             'tree': None
         })
 
+@app.route('/calculate/stream', methods=['GET', 'POST'])
+def calculate_stream():
+    # /calculate with the step trace streamed as NDJSON, or as Server-Sent
+    # Events with format=sse (GET takes the same fields as query parameters,
+    # for EventSource). offset/limit page through long traces.
+    data = request.get_json(silent=True) or request.args
+    accept = request.headers.get('Accept', '')
+    fmt = data.get('format') or ('sse' if 'text/event-stream' in accept else 'ndjson')
+    try:
+        offset = int(data.get('offset', 0))
+        limit = int(data['limit']) if data.get('limit') is not None else None
+        if limit is not None and limit <= 0:
+            raise ValueError('limit must be a positive number of steps.')
+        compiled = compile_expression(data.get('expression', ''))
+    except Exception as e:
+        metrics.record_error(e)
+        return jsonify({'error': str(e)}), 400
+    records = stream.stream_calculation(compiled, scope_store.snapshot(session_scope()), offset, limit)
+    if fmt == 'sse':
+        return Response((stream.encode_sse(r) for r in records), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    return Response((stream.encode_ndjson(r) for r in records), mimetype='application/x-ndjson')
+
+def _batch_variables(values, scope):
+    # Request-local bindings ({'a': 3, 'b': '2*pi'}), held as floats like
+    # the values /set_variable stores
+    if not isinstance(values, dict):
+        raise ValueError('variables must be an object of name: value pairs.')
+    bound = {}
+    for name, value in values.items():
+        if parser.token_kind(name) != 'var':
+            raise ValueError(f'Invalid variable name: {name}')
+        if isinstance(value, str):
+            bound[name] = dag.evaluate(compile_expression(value), scope)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            bound[name] = float(value)
+        else:
+            raise ValueError(f'Variable {name} must be a number or an expression.')
+    return bound
+
+@app.route('/calculate_batch', methods=['POST'])
+def calculate_batch():
+    data = request.get_json()
+    expressions = data.get('expressions', [])
+    if not isinstance(expressions, list) or not all(isinstance(e, str) for e in expressions):
+        return jsonify({'error': 'expressions must be a list of strings.'}), 400
+    scope = dict(scope_store.snapshot(session_scope()))
+    try:
+        scope.update(_batch_variables(data.get('variables') or {}, scope))
+    except Exception as e:
+        metrics.record_error(e)
+        return jsonify({'error': str(e)}), 400
+    with metrics.stage('evaluate_batch'):
+        results = batch.calculate_many(expressions, scope, trace=bool(data.get('steps', True)))
+    with metrics.stage('serialize'):
+        return jsonify({'results': results})
+
 @app.route('/evaluate', methods=['POST'])
 def evaluate():
     data = request.json
     expr = data.get('expression', '')
+    want_steps = bool(data.get('steps', True))
     try:
-        tokens = parser.tokenize(expr)
-        postfix, assign_var = parser.infix_to_postfix(tokens)
-        result, assigned = evaluator.evaluate_postfix(postfix, assign_var)
-        tree = parser.build_expression_tree(postfix)
-        steps = evaluator.get_evaluation_steps(postfix)
+        compiled = compile_expression(expr)
+        scope_id = session_scope()
+        result, steps = _evaluate_compiled(compiled, data, want_steps, scope_store.snapshot(scope_id))
+        assigned = compiled['assign_var']
+        recomputed = None
+        if assigned:
+            # Variables hold floats; exact results are stored as their nearest one
+            scope_store.set(scope_id, assigned, result if data.get('backend', 'float') == 'float' else numeric.to_native(result))
+            recomputed = worksheet.variables_changed(scope_id, [assigned])
         response = {
             'result': result,
-            'steps': steps,
-            'tree': tree,
+            'steps': steps or [],
+            'tree': _tree(compiled, data),
             'assignment': assigned
         }
-        return jsonify(response)
+        if recomputed:
+            response['worksheet'] = recomputed
+        if data.get('backend', 'float') != 'float':
+            response['result'] = numeric.format_result(result, data['backend'], data.get('precision', numeric.DEFAULT_PRECISION))
+            response['backend'] = data['backend']
+        with metrics.stage('serialize'):
+            return jsonify(response)
     except Exception as e:
+        metrics.record_error(e)
         return jsonify({'error': str(e)}), 400
 
+@app.route('/evaluate_vectorized', methods=['POST'])
+def evaluate_vectorized():
+    data = request.get_json()
+    expr = data.get('expression', '')
+    bindings = data.get('variables', {})
+    try:
+        with metrics.stage('evaluate_vectorized'):
+            values = vectorized.evaluate_vectorized(expr, bindings, scope_store.snapshot(session_scope()))
+        with metrics.stage('serialize'):
+            return jsonify({'result': vectorized.to_json(values)})
+    except Exception as e:
+        metrics.record_error(e)
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/plot', methods=['POST'])
+def plot():
+    # Adaptive samples of each expression over the viewport, downsampled to
+    # its pixel width; see utils/plot.py
+    data = request.get_json()
+    expressions = data.get('expressions', [data.get('expression', '')])
+    if not isinstance(expressions, list) or not all(isinstance(e, str) for e in expressions):
+        return jsonify({'error': 'expressions must be a list of strings.'}), 400
+    try:
+        x_min = float(data.get('x_min', -10))
+        x_max = float(data.get('x_max', 10))
+        y_min = float(data['y_min']) if data.get('y_min') is not None else None
+        y_max = float(data['y_max']) if data.get('y_max') is not None else None
+        width = int(data.get('width', 500))
+        height = int(data.get('height', 300))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Viewport bounds must be numbers.'}), 400
+    scope = scope_store.snapshot(session_scope())
+    plots = []
+    for expr in expressions:
+        try:
+            plots.append(plot_utils.sample_plot(expr, x_min, x_max, width, height, y_min, y_max,
+                                                data.get('variable', 'x'), scope))
+        except Exception as e:
+            metrics.record_error(e)
+            plots.append({'error': str(e)})
+    with metrics.stage('serialize'):
+        return jsonify({'plots': plots})
+
+@app.route('/compile', methods=['POST'])
+def compile_function():
+    data = request.get_json()
+    try:
+        entry = compiler.compile_callable(data.get('expression', ''), data.get('source', 'parser'))
+        return jsonify({'id': entry['id'], 'variables': entry['variables']})
+    except Exception as e:
+        metrics.record_error(e)
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/compiled/<expr_id>', methods=['POST'])
+def evaluate_compiled(expr_id):
+    data = request.get_json()
+    entry = compiler.compiled_functions.get(expr_id)
+    try:
+        if entry is None:
+            # Evicted, or compiled by another worker: recompile if the client sent the source
+            if 'expression' not in data:
+                return jsonify({'error': 'Unknown expression id.'}), 404
+            entry = compiler.compile_callable(data['expression'], data.get('source', 'parser'))
+        with metrics.stage('evaluate_compiled'):
+            values = compiler.evaluate_compiled(entry, data.get('variables', {}), scope_store.snapshot(session_scope()))
+        with metrics.stage('serialize'):
+            return jsonify({'id': entry['id'], 'result': vectorized.to_json(values)})
+    except Exception as e:
+        metrics.record_error(e)
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/startup', methods=['GET'])
+def startup():
+    # Import-time breakdown, for tracking cold starts
+    return jsonify(lazy.startup_report())
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify(expression_cache.stats())
+
 @app.route('/variables', methods=['GET'])
 def get_variables():
-    return jsonify(evaluator.get_variables())
+    return jsonify(dict(scope_store.snapshot(session_scope())))
 
 @app.route('/set_variable', methods=['POST'])
 def set_variable():
@@ -73,11 +287,18 @@ def set_variable():
     try:
         # Compose assignment expression and evaluate
         expr = f'{name} = {value}'
-        tokens = parser.tokenize(expr)
-        postfix, assign_var = parser.infix_to_postfix(tokens)
-        result, assigned = evaluator.evaluate_postfix(postfix, assign_var)
-        return jsonify({'success': True, 'result': result, 'assignment': assigned})
+        compiled = compile_expression(expr)
+        scope_id = session_scope()
+        result = dag.evaluate(compiled, scope_store.snapshot(scope_id))
+        assigned = compiled['assign_var']
+        scope_store.set(scope_id, assigned, result)
+        response = {'success': True, 'result': result, 'assignment': assigned}
+        recomputed = worksheet.variables_changed(scope_id, [assigned])
+        if recomputed:
+            response['worksheet'] = recomputed
+        return jsonify(response)
     except Exception as e:
+        metrics.record_error(e)
         return jsonify({'success': False, 'error': str(e)})
 
 @app.route('/delete_variable', methods=['POST'])
@@ -87,97 +308,211 @@ def delete_variable():
     if not name or not name.isalpha() or len(name) != 1:
         return jsonify({'success': False, 'error': 'Variable name must be a single letter.'})
     try:
-        # Remove from evaluator's variable dict
-        vars_dict = evaluator.get_variables()
-        if name in vars_dict:
-            del vars_dict[name]
-            # Overwrite the evaluator's variable dict
-            evaluator.variables.clear()
-            evaluator.variables.update(vars_dict)
+        scope_id = session_scope()
+        if scope_store.delete(scope_id, name):
+            worksheet.variables_changed(scope_id, [name])
             return jsonify({'success': True})
         else:
             return jsonify({'success': False, 'error': 'Variable not found.'})
     except Exception as e:
+        metrics.record_error(e)
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/worksheet', methods=['GET'])
+def get_worksheet():
+    try:
+        return jsonify(worksheet.describe(session_scope()))
+    except Exception as e:
+        metrics.record_error(e)
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/worksheet', methods=['POST'])
+def define_worksheet_cells():
+    # {'name': 'c', 'expression': 'a + b'}, {'expression': 'c = a + b'}, or
+    # {'cells': {'c': 'a + b', ...}}; returns the cells recomputed, in order
+    data = request.get_json()
+    cells = data.get('cells')
+    try:
+        if cells is None:
+            name, expr = data.get('name'), data.get('expression', '')
+            if not name:
+                name = compile_expression(expr)['assign_var']
+                expr = expr.split('=', 1)[1] if name else expr
+            if not name:
+                raise ValueError('Cell needs a name')
+            cells = {name: expr}
+        return jsonify(worksheet.define_cells(session_scope(), cells))
+    except Exception as e:
+        metrics.record_error(e)
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/worksheet/variables', methods=['POST'])
+def set_worksheet_variables():
+    # Sets several input variables ({'a': 1, 'b': '2*pi'}) and recomputes the
+    # cells downstream of any of them once, in one topological pass
+    data = request.get_json()
+    values = data.get('variables') or {}
+    scope_id = session_scope()
+    try:
+        for name, value in values.items():
+            if parser.token_kind(name) != 'var':
+                raise ValueError(f'Invalid variable name: {name}')
+            if isinstance(value, str):
+                value = dag.evaluate(compile_expression(value), scope_store.snapshot(scope_id))
+            scope_store.set(scope_id, name, value)
+        recomputed = worksheet.variables_changed(scope_id, list(values))
+        return jsonify(recomputed or {'updated': {}, 'errors': {}, 'order': []})
+    except Exception as e:
+        metrics.record_error(e)
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/worksheet/<name>', methods=['DELETE'])
+def delete_worksheet_cell(name):
+    try:
+        return jsonify(worksheet.remove_cell(session_scope(), name))
+    except Exception as e:
+        metrics.record_error(e)
+        return jsonify({'error': str(e)}), 404
+
+def _flag(value):
+    # JSON booleans, or 'true'/'false' strings from form fields
+    if value is None or isinstance(value, bool):
+        return value
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def _form_operand(name):
+    # .npy upload, or a stored matrix's handle as a plain form field
+    if name in request.files:
+        return matrix.decode_operand(request.files[name].read())
+    if name in request.form:
+        return matrix_store.get(request.form[name])
+    return matrix.decode_operand(None)
+
+def _matrix_response(result, info, data):
+    # Stored as a handle with 'store', else JSON lists, base64 buffers or .npy/.npz
+    payload = {}
+    if _flag(data.get('store')) and not isinstance(result, float):
+        payload['handle'] = store_result(result)
+    else:
+        fmt = data.get('format') or ('npy' if matrix.NPY_MIMETYPE in request.headers.get('Accept', '') else 'json')
+        if fmt == 'npy' and not isinstance(result, float):
+            body, mimetype = matrix.result_to_npy(result)
+            response = Response(body, mimetype=mimetype)
+            if 'condition' in info:
+                response.headers['X-Condition-Number'] = 'inf' if info['condition'] is None else repr(info['condition'])
+            if info['warnings']:
+                response.headers['X-Matrix-Warnings'] = ' '.join(info['warnings'])
+            return response
+        payload['result'] = matrix.result_to_json(result, binary=fmt == 'base64')
+    if 'condition' in info:
+        payload['condition'] = info['condition']
+    for key in ('conditions', 'handles', 'warnings'):
+        if info.get(key):
+            payload[key] = info[key]
+    return jsonify(payload)
+
 @app.route('/matrix', methods=['POST'])
 def matrix_calc():
-    data = request.get_json()
-    op = data.get('op')
-    A = np.array(data.get('A', []), dtype=float)
-    B = np.array(data.get('B', []), dtype=float)
-    try:
-        if op == 'add':
-            if A.shape != B.shape:
-                return jsonify({'error': 'Matrix sizes must match for addition.'})
-            result = (A + B).tolist()
-        elif op == 'subtract':
-            if A.shape != B.shape:
-                return jsonify({'error': 'Matrix sizes must match for subtraction.'})
-            result = (A - B).tolist()
-        elif op == 'multiply':
-            if A.shape[1] != B.shape[0]:
-                return jsonify({'error': 'A columns must match B rows for multiplication.'})
-            result = (A @ B).tolist()
-        elif op == 'detA':
-            if A.shape[0] != A.shape[1]:
-                return jsonify({'error': 'A must be square for determinant.'})
-            result = float(np.linalg.det(A))
-        elif op == 'detB':
-            if B.shape[0] != B.shape[1]:
-                return jsonify({'error': 'B must be square for determinant.'})
-            result = float(np.linalg.det(B))
-        elif op == 'invA':
-            if A.shape[0] != A.shape[1]:
-                return jsonify({'error': 'A must be square for inverse.'})
-            result = np.linalg.inv(A).tolist()
-        elif op == 'invB':
-            if B.shape[0] != B.shape[1]:
-                return jsonify({'error': 'B must be square for inverse.'})
-            result = np.linalg.inv(B).tolist()
-        elif op == 'transA':
-            result = A.T.tolist()
-        elif op == 'transB':
-            result = B.T.tolist()
+    # JSON (nested lists, {'shape', 'data': base64 float64} objects or
+    # {'handle': ...} from /matrix/upload) or multipart/form-data with A and B
+    # uploaded as .npy files
+    try:
+        if request.mimetype == 'multipart/form-data':
+            data = request.form
+            A, B = _form_operand('A'), _form_operand('B')
         else:
-            return jsonify({'error': 'Unknown operation.'})
-        return jsonify({'result': result})
+            data = request.get_json()
+            A = matrix_store.resolve(data.get('A', []))
+            B = matrix_store.resolve(data.get('B', []))
+        op = data.get('op')
+        result, info = matrix.run_operation(op, A, B, _flag(data.get('check_condition')))
+        return _matrix_response(result, info, data)
+    except matrix.MatrixError as e:
+        return jsonify({'error': str(e)})
     except Exception as e:
+        metrics.record_error(e)
         return jsonify({'error': str(e)})
 
+@app.route('/matrix/pipeline', methods=['POST'])
+def matrix_pipeline():
+    # Chained operations in one request; see matrix_store.run_pipeline
+    data = request.get_json()
+    try:
+        result, info = run_pipeline(data.get('steps', []), _flag(data.get('check_condition')))
+        return _matrix_response(result, info, data)
+    except matrix.MatrixError as e:
+        return jsonify({'error': str(e)})
+    except Exception as e:
+        metrics.record_error(e)
+        return jsonify({'error': str(e)})
+
+@app.route('/matrix/upload', methods=['POST'])
+def matrix_upload():
+    # One matrix, as JSON {'matrix': <list or base64 object>} or a .npy file
+    # field named 'matrix'; returns its handle for use as A or B
+    try:
+        if request.mimetype == 'multipart/form-data':
+            if 'matrix' not in request.files:
+                return jsonify({'error': 'No matrix provided'}), 400
+            value = matrix.decode_operand(request.files['matrix'].read())
+        else:
+            data = request.get_json()
+            if data.get('matrix') is None:
+                return jsonify({'error': 'No matrix provided'}), 400
+            value = matrix.decode_operand(data['matrix'])
+        return jsonify(matrix_store.info(matrix_store.put(value)))
+    except matrix.MatrixError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        metrics.record_error(e)
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/matrix/<handle>', methods=['GET'])
+def matrix_get(handle):
+    # Metadata, plus the data itself when ?format=json|base64|npy is given
+    try:
+        if 'format' not in request.args:
+            return jsonify(matrix_store.info(handle))
+        return _matrix_response(matrix_store.get(handle), {'warnings': []}, request.args)
+    except matrix.MatrixError as e:
+        return jsonify({'error': str(e)}), 404
+
+@app.route('/matrix/<handle>', methods=['DELETE'])
+def matrix_delete(handle):
+    if not matrix_store.delete(handle):
+        return jsonify({'error': f'Unknown matrix handle: {handle}'}), 404
+    return jsonify({'success': True})
+
 @app.route('/complex', methods=['POST'])
 def complex_calc():
     data = request.get_json()
-    z1 = data.get('z1', '').replace(' ', '').replace('i', 'j')
-    z2 = data.get('z2', '').replace(' ', '').replace('i', 'j')
     op = data.get('op')
     try:
-        c1 = complex(z1) if z1 else 0
-        c2 = complex(z2) if z2 else 0
-        if op == 'add':
-            res = c1 + c2
-        elif op == 'subtract':
-            res = c1 - c2
-        elif op == 'multiply':
-            res = c1 * c2
-        elif op == 'divide':
-            if c2 == 0:
-                return jsonify({'error': 'Division by zero'})
-            res = c1 / c2
-        elif op == 'mod':
-            res = abs(c1)
+        res, mask = complex_ops.run_complex(op, data.get('z1', ''), data.get('z2', ''))
+        if mask.any():
+            return jsonify({'error': 'Division by zero' if op in ('divide', 'pow') else 'Result is not finite'})
+        res = res.item()
+        if op in ('mod', 'arg'):
             return jsonify({'result': res})
-        elif op == 'conj':
-            res = c1.conjugate()
-        else:
-            return jsonify({'error': 'Unknown operation'})
         return jsonify({'result': {'re': res.real, 'im': res.imag}})
     except Exception as e:
+        metrics.record_error(e)
         return jsonify({'error': str(e)})
 
-def insert_mult(expr):
-    # Insert * between number and variable (e.g., 2x -> 2*x)
-    return re.sub(r'(\d)([a-zA-Z])', r'\1*\2', expr)
+@app.route('/complex_batch', methods=['POST'])
+def complex_batch():
+    # z1/z2 as lists of strings or numbers, {'re', 'im'} or polar {'r', 'theta'}
+    # columns; a single value is broadcast against a list
+    data = request.get_json()
+    degrees = bool(data.get('degrees', False))
+    try:
+        with metrics.stage('complex_batch'):
+            values, mask = complex_ops.run_complex(data.get('op'), data.get('z1'), data.get('z2'), degrees)
+        with metrics.stage('serialize'):
+            return jsonify(complex_ops.to_columns(values, mask, data.get('output', 'rect'), degrees))
+    except Exception as e:
+        metrics.record_error(e)
+        return jsonify({'error': str(e)}), 400
 
 @app.route('/equation', methods=['POST'])
 def equation_solver():
@@ -189,29 +524,18 @@ def equation_solver():
         if variable and not re.fullmatch(r'[a-zA-Z]', variable):
             return jsonify({'error': 'Variable must be a single letter (e.g., x).'}), 400
         # Parse variable or auto-detect
-        if variable:
-            var = symbols(variable)
-        else:
+        if not variable:
             m = re.search(r'([a-zA-Z])', eqn)
             if not m:
                 return jsonify({'error': 'No variable found in equation.'})
-            var = symbols(m.group(1))
-        # Split equation at '='
-        if '=' in eqn:
-            left, right = eqn.split('=', 1)
-        else:
-            left, right = eqn, '0'
-        left = insert_mult(left)
-        right = insert_mult(right)
-        left_expr = sympify(left)
-        right_expr = sympify(right)
-        equation = Eq(left_expr, right_expr)
-        sol = solve(equation, var)
-        steps = [f"Equation: {left_expr} = {right_expr}", f"Solve for {var}", f"Solution: {sol}"]
-        return jsonify({'result': str(sol), 'steps': steps})
+            variable = m.group(1)
+        return jsonify(solver.solve_equation(eqn, variable))
     except Exception as e:
+        metrics.record_error(e)
         return jsonify({'error': str(e)})
 
+lazy.record_import('app', time.perf_counter() - _import_start)
+
 if __name__ == "__main__":
     import os
     port = int(os.environ.get("PORT", 5000))
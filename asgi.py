@@ -0,0 +1,7 @@
+# ASGI entry point, e.g. `uvicorn asgi:app --workers 2`: serves the same
+# routes as app.py, with cheap ones inline on the event loop and NumPy and
+# sympy routes in bounded pools (see utils/serving.py).
+from app import app as flask_app
+from utils.serving import AsgiApp
+
+app = AsgiApp(flask_app)
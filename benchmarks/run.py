@@ -0,0 +1,305 @@
+"""Benchmarks for the parse/evaluate/tree pipeline and the HTTP routes.
+
+Usage (from the repository root):
+    python benchmarks/run.py                       # run and print a report
+    python benchmarks/run.py --save                # also save as the baseline
+    python benchmarks/run.py --compare             # fail if slower than the baseline
+    python benchmarks/run.py --filter tokenize --min-time 0.5
+    python benchmarks/run.py --parity              # check /compile against /calculate
+
+Each case reports ops/sec, latency percentiles (p50/p95/p99, microseconds)
+and peak traced memory for one call. --compare exits with status 1 when a
+case's ops/sec drops more than --tolerance below the saved baseline.
+--parity instead evaluates the corpus and some edge cases through both the
+compiled (NumPy) path and the interpreter, and exits with status 1 when they
+disagree on a value or an error.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import utils.parser as parser
+import utils.evaluator as evaluator
+import utils.numeric as numeric
+from utils.dag import build_dag
+
+BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+FUNCTIONS = ['sin', 'cos', 'tan', 'sqrt', 'exp', 'abs', 'atan', 'log10']
+VARIABLES = {'x': 0.5, 'y': 1.25, 'z': 2.0}
+
+# Synthetic corpus, generated from a fixed seed so runs are comparable
+
+def _atom(rng, complex_ratio):
+    roll = rng.random()
+    if roll < complex_ratio:
+        return f'{rng.randint(1, 9)}i'
+    if roll < 0.5:
+        return rng.choice(list(VARIABLES))
+    return str(round(rng.uniform(1, 100), rng.randint(0, 3)))
+
+def expr_length(n, seed=1, complex_ratio=0.0):
+    # Flat expression with n operands joined by + - *
+    rng = random.Random(seed)
+    parts = [_atom(rng, complex_ratio)]
+    for _ in range(n - 1):
+        parts.append(rng.choice('+-*'))
+        parts.append(_atom(rng, complex_ratio))
+    return ''.join(parts)
+
+def expr_depth(n):
+    # n nested parenthesized additions
+    return '(' * n + '1' + ''.join(f'+{i % 9 + 1})' for i in range(n))
+
+def expr_functions(n, seed=2):
+    # Sum of n function applications over x
+    rng = random.Random(seed)
+    terms = []
+    for i in range(n):
+        fn = rng.choice(FUNCTIONS)
+        terms.append(f'{fn}(x+{i % 7 + 1})')
+    return '+'.join(terms)
+
+def expr_repeated(n, seed=5):
+    # n terms drawn from a few shared subterms, like generated expressions
+    rng = random.Random(seed)
+    subterms = ['sin(x)^2', 'cos(x)^2', 'sin(x)*cos(x)', 'sqrt(x^2+y^2)', 'exp(-x*y)']
+    return '+'.join(f'{rng.choice(subterms)}*{i % 9 + 1}' for i in range(n))
+
+def corpus(sizes):
+    cases = {}
+    for n in sizes:
+        cases[f'length-{n}'] = expr_length(n)
+        cases[f'depth-{n}'] = expr_depth(n)
+        cases[f'functions-{n}'] = expr_functions(n)
+        cases[f'complex-{n}'] = expr_length(n, seed=3, complex_ratio=0.3)
+        cases[f'repeated-{n}'] = expr_repeated(n)
+    return cases
+
+def matrix(n, seed=4):
+    rng = random.Random(seed)
+    return [[rng.uniform(-1, 1) + (n if i == j else 0) for j in range(n)] for i in range(n)]
+
+# Measurement
+
+def measure(func, min_time=0.2, max_calls=100000):
+    latencies = []
+    start = time.perf_counter()
+    while len(latencies) < max_calls:
+        t0 = time.perf_counter_ns()
+        func()
+        latencies.append(time.perf_counter_ns() - t0)
+        if time.perf_counter() - start >= min_time and len(latencies) >= 5:
+            break
+    total = sum(latencies)
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] / 1000
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'calls': len(latencies),
+        'ops_per_sec': len(latencies) / (total / 1e9) if total else float('inf'),
+        'p50_us': pct(0.50),
+        'p95_us': pct(0.95),
+        'p99_us': pct(0.99),
+        'peak_kib': peak / 1024
+    }
+
+def pipeline_cases(sizes):
+    cases = {}
+    scope = dict(VARIABLES)
+    for name, expr in corpus(sizes).items():
+        tokens = parser.tokenize(expr)
+        postfix, _ = parser.infix_to_postfix(tokens)
+        cases[f'tokenize/{name}'] = lambda e=expr: parser.tokenize(e)
+        cases[f'infix_to_postfix/{name}'] = lambda t=tokens: parser.infix_to_postfix(t)
+        cases[f'build_expression_tree/{name}'] = lambda p=postfix: parser.build_expression_tree(p)
+        cases[f'evaluate_postfix/{name}'] = lambda p=postfix: evaluator.evaluate(p, scope=scope)
+        cases[f'get_evaluation_steps/{name}'] = lambda p=postfix: evaluator.evaluate(p, trace=True, scope=scope)
+        if name.startswith('repeated'):
+            dag = build_dag(postfix)
+            cases[f'build_dag/{name}'] = lambda p=postfix: build_dag(p)
+            cases[f'dag evaluate/{name}'] = lambda d=dag: d.evaluate(scope)
+        if name.startswith('length'):
+            program = parser.compile_postfix(postfix)
+            for backend in numeric.BACKENDS:
+                cases[f'run_backend {backend}/{name}'] = lambda p=program, b=backend: numeric.run_backend(p, b, scope=scope)
+    return cases
+
+def http_cases(sizes, matrix_sizes):
+    import numpy as np
+    from app import app
+    from utils.cache import expression_cache
+    from utils.matrix import encode_array
+    from utils.plot import plot_cache, sample_cache
+
+    client = app.test_client()
+    for name, value in VARIABLES.items():
+        client.post('/set_variable', json={'name': name, 'value': str(value)})
+    cases = {}
+
+    def post(url, body):
+        response = client.post(url, json=body)
+        if response.status_code != 200:
+            raise RuntimeError(f'{url} returned {response.status_code}')
+        return response
+
+    def cold(body):
+        expression_cache.clear()
+        return post('/calculate', body)
+
+    def cold_plot(body):
+        plot_cache.clear()
+        sample_cache.clear()
+        return post('/plot', body)
+
+    for name, expr in corpus(sizes).items():
+        body = {'expression': expr}
+        cases[f'POST /calculate/{name}'] = lambda b=body: post('/calculate', b)
+        cases[f'POST /calculate (cold cache)/{name}'] = lambda b=body: cold(b)
+        cases[f'POST /calculate (no steps)/{name}'] = lambda b=dict(body, steps=False): post('/calculate', b)
+        if not name.startswith('complex'):
+            # /evaluate answers 400 for complex results, which JSON can't encode
+            cases[f'POST /evaluate/{name}'] = lambda b=body: post('/evaluate', b)
+    for n in sizes:
+        rng = random.Random(6)
+        z1 = {'re': [rng.uniform(-1, 1) for _ in range(n)], 'im': [rng.uniform(-1, 1) for _ in range(n)]}
+        z2 = [f'{rng.randint(-3, 3)}{rng.randint(-3, 3):+d}i' for _ in range(n)]
+        for op in ('multiply', 'divide'):
+            body = {'op': op, 'z1': z1, 'z2': z2}
+            cases[f'POST /complex_batch {op}/{n}'] = lambda b=body: post('/complex_batch', b)
+    for expr in ('sin(x)*x', 'tan(x)', 'log(x)'):
+        body = {'expressions': [expr], 'x_min': -10, 'x_max': 10, 'y_min': -10, 'y_max': 10}
+        cases[f'POST /plot/{expr}'] = lambda b=body: post('/plot', b)
+        cases[f'POST /plot (cold cache)/{expr}'] = lambda b=body: cold_plot(b)
+    for n in matrix_sizes:
+        A = matrix(n)
+        B = matrix(n, seed=5)
+        for op in ('add', 'multiply', 'detA', 'invA', 'transA'):
+            body = {'op': op, 'A': A, 'B': B}
+            cases[f'POST /matrix {op}/{n}x{n}'] = lambda b=body: post('/matrix', b)
+        body = {'op': 'solve', 'A': encode_array(np.array(A)), 'B': encode_array(np.array(B)), 'format': 'base64'}
+        cases[f'POST /matrix solve (base64)/{n}x{n}'] = lambda b=body: post('/matrix', b)
+        handles = [post('/matrix/upload', {'matrix': M}).get_json()['handle'] for M in (A, B)]
+        body = {'op': 'multiply', 'A': {'handle': handles[0]}, 'B': {'handle': handles[1]}, 'store': True}
+        cases[f'POST /matrix multiply (handles)/{n}x{n}'] = lambda b=body: post('/matrix', b)
+    return cases
+
+# Parity of compiled functions with the interpreter
+
+PARITY_EXPRESSIONS = ['1/x', 'x/x', 'x^-1', 'x^0.5', 'x^y', 'sqrt(x)', 'log(x)', 'log10(x)', 'asin(x)',
+                      'acos(x)', 'exp(x)', '2^x', 'x*i', 'sin(x)^2+cos(x)^2']
+PARITY_POINTS = [-4.0, -1.0, 0.0, 0.5, 2.0, 1000.0]
+
+def _outcome(func):
+    try:
+        return func(), None
+    except Exception as e:
+        return None, str(e)
+
+def parity(sizes):
+    import numpy as np
+    from utils.cache import compile_expression
+    from utils.compiler import compile_callable, evaluate_compiled
+    from utils.dag import evaluate
+
+    expressions = PARITY_EXPRESSIONS + [e for n, e in corpus(sizes).items() if not n.startswith('depth')]
+    mismatches = []
+    for expr in expressions:
+        entry = compile_callable(expr)
+        for x in PARITY_POINTS:
+            scope = dict(VARIABLES, x=x)
+            expected, expected_error = _outcome(lambda: evaluate(compile_expression(expr), scope))
+            got, got_error = _outcome(lambda: complex(evaluate_compiled(entry, {'x': x}, scope)[()]))
+            if expected_error or got_error:
+                ok = expected_error == got_error
+            else:
+                ok = bool(np.isclose(got, complex(expected), rtol=1e-9, atol=1e-12))
+            if not ok:
+                mismatches.append(expr)
+                print(f'MISMATCH {expr} at x={x}: interpreter {expected_error or expected!r}, '
+                      f'compiled {got_error or got!r}')
+    return mismatches
+
+def run(args):
+    cases = pipeline_cases(args.sizes)
+    if not args.no_http:
+        cases.update(http_cases(args.sizes, args.matrix_sizes))
+    results = {}
+    for name, func in cases.items():
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = measure(func, args.min_time)
+        r = results[name]
+        print(f"{name:<60} {r['ops_per_sec']:>12.1f} ops/s  p50 {r['p50_us']:>10.1f}us  "
+              f"p95 {r['p95_us']:>10.1f}us  p99 {r['p99_us']:>10.1f}us  peak {r['peak_kib']:>9.1f}KiB")
+    return results
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        ratio = r['ops_per_sec'] / base['ops_per_sec']
+        if ratio < 1 - tolerance:
+            regressions.append((name, ratio))
+    for name, ratio in regressions:
+        print(f'REGRESSION {name}: {ratio:.2f}x of baseline ops/sec')
+    return regressions
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000],
+                    help='corpus sizes (operands, nesting depth, function calls)')
+    ap.add_argument('--matrix-sizes', type=int, nargs='+', default=[10, 100, 300])
+    ap.add_argument('--min-time', type=float, default=0.2, help='seconds to spend per case')
+    ap.add_argument('--filter', help='only run cases whose name contains this text')
+    ap.add_argument('--no-http', action='store_true', help='skip the Flask route benchmarks')
+    ap.add_argument('--baseline', default=BASELINE, help='baseline file for --save/--compare')
+    ap.add_argument('--save', action='store_true', help='save results as the baseline')
+    ap.add_argument('--compare', action='store_true', help='compare against the baseline')
+    ap.add_argument('--tolerance', type=float, default=0.25,
+                    help='allowed ops/sec drop before a case counts as a regression')
+    ap.add_argument('--json', help='also write results to this file')
+    ap.add_argument('--parity', action='store_true',
+                    help='check compiled functions against the interpreter instead of timing')
+    args = ap.parse_args(argv)
+
+    if args.parity:
+        if parity(args.sizes):
+            return 1
+        print('Compiled functions match the interpreter')
+        return 0
+
+    results = run(args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    status = 0
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            status = 1
+        else:
+            print(f'No regressions against {args.baseline}')
+    if args.save:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f'Saved baseline to {args.baseline}')
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,7 @@
+# Serverless entry point (see vercel.json): serves the Flask app with heavy
+# modules deferred until a route needs them, so cold starts skip numpy/sympy.
+import os
+
+os.environ.setdefault('LAZY_IMPORTS', '1')
+
+from app import app  # noqa: E402
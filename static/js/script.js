@@ -20,6 +20,13 @@ const addVarBtn = document.getElementById('addVarBtn');
 const varAssignMsg = document.getElementById('varAssignMsg');
 const varList = document.getElementById('varList');
 
+// Per-browser session token; the backend keeps variables separately per session
+let sessionId = localStorage.getItem('sessionId');
+if (!sessionId) {
+    sessionId = window.crypto && crypto.randomUUID ? crypto.randomUUID() : Date.now().toString(36) + Math.random().toString(36).slice(2);
+    localStorage.setItem('sessionId', sessionId);
+}
+
 // Show welcome modal on first visit
 if (!localStorage.getItem('hasSeenWelcome')) {
     setTimeout(() => {
@@ -288,7 +295,7 @@ function showAnimatedSteps(steps) {
 
 function fetchAndRenderVariables() {
     if (!variablesList) return;
-    fetch('/variables')
+    fetch('/variables', { headers: { 'X-Session-Id': sessionId } })
         .then(res => res.json())
         .then(vars => {
             variablesList.innerHTML = '';
@@ -322,10 +329,12 @@ function evaluateInput() {
     const expr = input.value.trim();
     if (!expr) return;
     showSpinner();
+    const modeSelect = document.getElementById('numericMode');
+    const backend = modeSelect ? modeSelect.value : 'float';
     fetch('/calculate', {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ expression: expr })
+        headers: { 'Content-Type': 'application/json', 'X-Session-Id': sessionId },
+        body: JSON.stringify({ expression: expr, backend })
     })
     .then(res => res.json())
     .then(data => {
@@ -350,7 +359,10 @@ function evaluateInput() {
 
         // Render tree, but catch errors so result is never overwritten
         try {
-            if (data.tree) {
+            if (data.tree && data.tree.values) {
+                // Very deep trees come back as flat arrays and are too deep to draw
+                treePre.innerHTML = '<div class="text-slate-400">Expression tree is too deep to draw (' + data.tree.values.length + ' nodes).</div>';
+            } else if (data.tree) {
                 treePre.innerHTML = renderTreeSVG(data.tree);
             } else {
                 treePre.innerHTML = '';
@@ -462,50 +474,33 @@ function parseFunctionLine(line) {
     return { expr, isInequality, op, raw: line };
 }
 
-function safeEvalGraph(expr, x) {
-    let jsExpr = expr.replace(/\^/g, '**')
-        .replace(/sin\(/g, 'Math.sin(')
-        .replace(/cos\(/g, 'Math.cos(')
-        .replace(/tan\(/g, 'Math.tan(')
-        .replace(/log\(/g, 'Math.log(')
-        .replace(/sqrt\(/g, 'Math.sqrt(')
-        .replace(/pi/g, 'Math.PI')
-        .replace(/e/g, 'Math.E');
-    try {
-        // eslint-disable-next-line no-eval
-        return eval(jsExpr);
-    } catch {
-        return NaN;
-    }
-}
-
 function plotGraph() {
     const lines = (graphFunctions.value || '').split('\n').map(l => l.trim()).filter(l => l);
     if (!lines.length) return;
-    loadChartJs(() => {
-        const xs = [];
-        for (let i = 0; i <= 200; i++) {
-            xs.push(graphXMin + (graphXMax - graphXMin) * i / 200);
-        }
+    const parsedLines = lines.map(parseFunctionLine).filter(p => p);
+    // Sampled server-side: adaptive around curvature and singularities, cached per viewport
+    const request = fetch('/plot', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'X-Session-Id': sessionId },
+        body: JSON.stringify({
+            expressions: parsedLines.map(p => p.expr),
+            x_min: graphXMin, x_max: graphXMax, y_min: graphYMin, y_max: graphYMax,
+            width: graphCanvas.width, height: graphCanvas.height
+        })
+    }).then(res => res.json());
+    loadChartJs(() => request.then(data => {
         const datasets = [];
         graphLegend.innerHTML = '';
-        lines.forEach((line, idx) => {
-            const parsed = parseFunctionLine(line);
-            if (!parsed) return;
+        parsedLines.forEach((parsed, idx) => {
+            const line = parsed.raw;
+            const plot = (data.plots || [])[idx] || { error: data.error || 'Error' };
             const color = graphColors[idx % graphColors.length];
+            const points = plot.error ? [] : plot.x.map((x, i) => ({ x, y: plot.y[i] }));
             if (parsed.isInequality) {
                 // Plot as shaded region
-                const ys = xs.map(x => safeEvalGraph(parsed.expr, x));
-                const base = parsed.op.includes('>') ? graphYMin : graphYMax;
-                const fill = parsed.op.includes('>') ? '+1' : '-1';
                 datasets.push({
                     label: line,
-                    data: ys.map((y, i) => {
-                        if (isNaN(y)) return null;
-                        if (parsed.op === '>' || parsed.op === '>=') return y;
-                        if (parsed.op === '<' || parsed.op === '<=') return y;
-                        return null;
-                    }),
+                    data: points,
                     borderColor: color,
                     backgroundColor: color + '33',
                     fill: {
@@ -519,38 +514,42 @@ function plotGraph() {
                     showLine: true,
                 });
             } else {
-                // Regular function
-                const ys = xs.map(x => safeEvalGraph(parsed.expr, x));
+                // Regular function; null y values leave gaps at breaks
                 datasets.push({
                     label: line,
-                    data: ys,
+                    data: points,
                     borderColor: color,
                     backgroundColor: color + '33',
                     pointRadius: 0,
                     borderWidth: 2,
                     showLine: true,
+                    spanGaps: false,
                 });
             }
             // Add to legend
             const legendItem = document.createElement('span');
-            legendItem.innerHTML = `<span style="display:inline-block;width:18px;height:3px;background:${color};margin-right:6px;vertical-align:middle;"></span>${line}`;
+            const label = plot.error ? `${line} (${plot.error})` : line;
+            legendItem.innerHTML = `<span style="display:inline-block;width:18px;height:3px;background:${color};margin-right:6px;vertical-align:middle;"></span>${label}`;
             graphLegend.appendChild(legendItem);
         });
         if (window.chartInstance) window.chartInstance.destroy();
         window.chartInstance = new Chart(graphCanvas.getContext('2d'), {
             type: 'line',
-            data: { labels: xs, datasets },
+            data: { datasets },
             options: {
                 responsive: false,
                 animation: false,
+                parsing: false,
                 scales: {
-                    x: { min: graphXMin, max: graphXMax, title: { display: true, text: 'x' } },
+                    x: { type: 'linear', min: graphXMin, max: graphXMax, title: { display: true, text: 'x' } },
                     y: { min: graphYMin, max: graphYMax, title: { display: true, text: 'y' } }
                 },
                 plugins: { legend: { display: false } }
             }
         });
-    });
+    }).catch(() => {
+        graphLegend.textContent = 'Error';
+    }));
 }
 
 if (plotBtn) {
@@ -780,7 +779,7 @@ function showVarMsg(msg, isError = true) {
 }
 
 function refreshVarList() {
-    fetch('/variables')
+    fetch('/variables', { headers: { 'X-Session-Id': sessionId } })
         .then(res => res.json())
         .then(vars => {
             varList.innerHTML = '';
@@ -810,7 +809,7 @@ function refreshVarList() {
                     const k = btn.getAttribute('data-key');
                     fetch('/delete_variable', {
                         method: 'POST',
-                        headers: { 'Content-Type': 'application/json' },
+                        headers: { 'Content-Type': 'application/json', 'X-Session-Id': sessionId },
                         body: JSON.stringify({ name: k })
                     })
                     .then(res => res.json())
@@ -843,7 +842,7 @@ if (addVarBtn) {
         // Send to backend for assignment
         fetch('/set_variable', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: { 'Content-Type': 'application/json', 'X-Session-Id': sessionId },
             body: JSON.stringify({ name, value })
         })
         .then(res => res.json())
@@ -909,19 +908,39 @@ function getMatrixValues(rows, cols, prefix) {
     return mat;
 }
 
-function showMatrixResult(res) {
-    if (Array.isArray(res)) {
-        // Matrix result
-        let html = '<table class="border-collapse">';
-        for (const row of res) {
-            html += '<tr>' + row.map(x => `<td class='border px-3 py-1'>${x}</td>`).join('') + '</tr>';
-        }
-        html += '</table>';
-        matrixResult.innerHTML = html;
+function matrixTable(res) {
+    // 2-D arrays as a table; 1-D results (eigenvalues, singular values) as one row
+    const rows = Array.isArray(res[0]) ? res : [res];
+    let html = '<table class="border-collapse">';
+    for (const row of rows) {
+        html += '<tr>' + row.map(x => `<td class='border px-3 py-1'>${x}</td>`).join('') + '</tr>';
+    }
+    html += '</table>';
+    return html;
+}
+
+function matrixPart(res) {
+    if (Array.isArray(res)) return matrixTable(res);
+    if (typeof res === 'object' && 're' in res && 'im' in res) {
+        // Complex array: show a+bi entries
+        const join = (re, im) => Array.isArray(re) ? re.map((r, i) => join(r, im[i])) : `${re}${im < 0 ? '-' : '+'}${Math.abs(im)}i`;
+        return matrixTable(join(res.re, res.im));
+    }
+    return String(res);
+}
+
+function showMatrixResult(res, warnings) {
+    let html;
+    if (res !== null && typeof res === 'object' && !Array.isArray(res) && !('re' in res)) {
+        // Decomposition: one table per named factor
+        html = Object.entries(res).map(([name, part]) => `<div class='font-semibold mt-2'>${name}</div>` + matrixPart(part)).join('');
     } else {
-        // Scalar result
-        matrixResult.textContent = res;
+        html = matrixPart(res);
+    }
+    if (warnings && warnings.length) {
+        html += warnings.map(w => `<div class='text-yellow-600 mt-2'>${w}</div>`).join('');
     }
+    matrixResult.innerHTML = html;
 }
 
 function updateMatrixInputs() {
@@ -958,7 +977,7 @@ if (matrixCalcBtn) {
             if (data.error) {
                 matrixResult.textContent = data.error;
             } else {
-                showMatrixResult(data.result);
+                showMatrixResult(data.result, data.warnings);
             }
         })
         .catch(() => {
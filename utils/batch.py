@@ -0,0 +1,75 @@
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import utils.dag as dag
+import utils.evaluator as evaluator
+from utils.cache import compile_expression, normalize_expression
+from utils.jsonutil import json_value
+
+__all__ = ['calculate_one', 'calculate_many']
+
+# Batches with at least this many distinct expressions are spread over a
+# process pool; smaller ones run inline where pool overhead would dominate.
+POOL_THRESHOLD = int(os.environ.get('BATCH_POOL_THRESHOLD', 4096))
+POOL_WORKERS = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 1))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS)
+        return _pool
+
+def calculate_one(expr, scope=None, trace=True):
+    # Same response shape as /calculate, for one expression
+    try:
+        compiled = compile_expression(expr)
+        if trace:
+            result, _, steps = evaluator.run_program(compiled['program'], trace=True, scope=scope)
+        else:
+            result, steps = dag.evaluate(compiled, scope), None
+        return {
+            'result': json_value(result),
+            'tokens': compiled['tokens'],
+            'postfix': compiled['postfix'],
+            'steps': steps or [],
+            'tree': compiled['tree']
+        }
+    except Exception as e:
+        return {
+            'result': 'Error',
+            'tokens': [],
+            'postfix': [],
+            'steps': [str(e)],
+            'tree': None
+        }
+
+def _calculate_chunk(expressions, scope, trace):
+    return [calculate_one(expr, scope, trace) for expr in expressions]
+
+def calculate_many(expressions, scope=None, trace=True):
+    # Evaluates each distinct (whitespace-normalized) expression once against
+    # a snapshot of scope and returns results in request order. Assignments
+    # are not stored, as with /calculate.
+    scope = dict(evaluator.variables if scope is None else scope)
+    keys = [normalize_expression(expr) for expr in expressions]
+    index = {}
+    unique = []
+    for key in keys:
+        if key not in index:
+            index[key] = len(unique)
+            unique.append(key)
+    if len(unique) >= POOL_THRESHOLD and POOL_WORKERS > 1:
+        size = math.ceil(len(unique) / POOL_WORKERS)
+        chunks = [unique[i:i + size] for i in range(0, len(unique), size)]
+        pool = _get_pool()
+        futures = [pool.submit(_calculate_chunk, chunk, scope, trace) for chunk in chunks]
+        results = [item for future in futures for item in future.result()]
+    else:
+        results = _calculate_chunk(unique, scope, trace)
+    return [results[index[key]] for key in keys]
@@ -0,0 +1,117 @@
+import os
+import threading
+from collections import OrderedDict
+
+import utils.metrics as metrics
+import utils.parser as parser
+from utils.dag import build_dag
+from utils.optimizer import optimize_postfix
+
+__all__ = ['LRUCache', 'normalize_expression', 'compile_expression', 'expression_cache']
+
+# Bounded least-recently-used cache with hit/miss/eviction counters
+class LRUCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+# Compiled expressions, keyed by whitespace-normalized source text
+expression_cache = LRUCache(int(os.environ.get('EXPR_CACHE_SIZE', 4096)))
+
+@metrics.register_collector
+def _cache_metrics():
+    stats = expression_cache.stats()
+    return [
+        ('expression_cache_hits_total', 'counter', 'Expression cache hits.', stats['hits']),
+        ('expression_cache_misses_total', 'counter', 'Expression cache misses.', stats['misses']),
+        ('expression_cache_evictions_total', 'counter', 'Expression cache evictions.', stats['evictions']),
+        ('expression_cache_size', 'gauge', 'Compiled expressions currently cached.', stats['size'])
+    ]
+
+def normalize_expression(expr):
+    return ''.join(expr.split())
+
+def compile_expression(expr):
+    # Returns the parsed form of expr; parsing only runs on a cache miss
+    key = normalize_expression(expr)
+    compiled = expression_cache.get(key)
+    if compiled is None:
+        with metrics.stage('tokenize'):
+            tokens = parser.tokenize(key)
+        with metrics.stage('shunting_yard'):
+            postfix, assign_var = parser.infix_to_postfix(tokens)
+        with metrics.stage('compile'):
+            program = parser.compile_postfix(postfix)
+            # Constant-folded program, for evaluations that don't need a step trace
+            folded = optimize_postfix(postfix)
+            optimized = parser.compile_postfix(folded)
+        with metrics.stage('dag'):
+            # Shared-subexpression form of it, kept when it is enough smaller to
+            # beat the linear walk (a DAG node costs ~1.3x a program step)
+            dag = build_dag(folded)
+            if not dag.saved or len(dag) * 4 > len(optimized) * 3:
+                dag = None
+        with metrics.stage('tree'):
+            tree = parser.build_expression_tree(postfix)
+        compiled = {
+            'tokens': tokens,
+            'postfix': postfix,
+            'program': program,
+            'optimized': optimized,
+            'dag': dag,
+            'assign_var': assign_var,
+            'tree': tree
+        }
+        expression_cache.put(key, compiled)
+    return compiled
@@ -0,0 +1,122 @@
+import hashlib
+import os
+
+import numpy as np
+import sympy
+
+import utils.parser as parser
+import utils.vectorized as vectorized
+from utils.cache import LRUCache, compile_expression, normalize_expression
+from utils.solver import insert_mult
+
+__all__ = ['postfix_to_sympy', 'compile_callable', 'evaluate_compiled', 'compiled_functions']
+
+# Compiled callables by expression id, shared across requests
+compiled_functions = LRUCache(int(os.environ.get('COMPILED_CACHE_SIZE', 1024)))
+
+SYMPY_FUNCTIONS = {
+    'sin': sympy.sin, 'cos': sympy.cos, 'tan': sympy.tan,
+    'log': sympy.log, 'log10': lambda a: sympy.log(a, 10), 'sqrt': sympy.sqrt,
+    'exp': sympy.exp, 'asin': sympy.asin, 'acos': sympy.acos, 'atan': sympy.atan,
+    'abs': sympy.Abs, 'mod': sympy.Abs, 'conj': sympy.conjugate, 'neg': lambda a: -a,
+}
+# Division and powers are kept as opaque calls, so the compiled function
+# runs the interpreter's versions (and x/x still raises at x = 0)
+DIVIDE = sympy.Function('_divide')
+POWER = sympy.Function('_power')
+SYMPY_OPERATORS = {
+    '+': lambda a, b: a + b, '-': lambda a, b: a - b, '*': lambda a, b: a * b,
+    '/': lambda a, b: DIVIDE(a, b), '^': lambda a, b: POWER(a, b), '**': lambda a, b: POWER(a, b),
+}
+SYMPY_CONSTANTS = {'pi': sympy.pi, 'e': sympy.E}
+
+# Functions whose NumPy versions would silently return NaN or inf are swapped
+# for the vectorized evaluator's, so sqrt and fractional powers of negatives
+# go complex, and domain errors, division by zero and overflow in exp and
+# powers raise as they do in the interpreter.
+NUMPY_OVERRIDES = {name: vectorized.VECTOR_OPCODES[name][1] for name in ('sqrt', 'log', 'asin', 'acos', 'exp')}
+NUMPY_OVERRIDES.update({'_divide': vectorized.VECTOR_OPCODES['/'][1], '_power': vectorized.VECTOR_OPCODES['^'][1]})
+
+def _sympy_real(text):
+    return sympy.Float(text) if '.' in text else sympy.Integer(int(text))
+
+def _sympy_number(token):
+    # Exact sympy number for a literal token ('2', '-3.5', '2i', '-1i')
+    if token.endswith('i'):
+        coef = token[:-1]
+        if coef in ('', '+', '-'):
+            return -sympy.I if coef == '-' else sympy.I
+        return _sympy_real(coef) * sympy.I
+    return _sympy_real(token)
+
+def postfix_to_sympy(postfix):
+    stack = []
+    for token in postfix:
+        kind = parser.token_kind(token)
+        if kind == 'number' or kind == 'imag':
+            stack.append(_sympy_number(token))
+        elif kind == 'const':
+            stack.append(SYMPY_CONSTANTS[token])
+        elif kind == 'var':
+            stack.append(sympy.Symbol(token))
+        elif kind == 'binary':
+            b = stack.pop()
+            a = stack.pop()
+            stack.append(SYMPY_OPERATORS[token](a, b))
+        elif kind == 'unary':
+            stack.append(SYMPY_FUNCTIONS[token](stack.pop()))
+        else:
+            raise ValueError(f'Unknown token in evaluation: {token}')
+    if len(stack) != 1:
+        raise ValueError('Invalid expression for evaluation')
+    return stack[0]
+
+def _expression_id(source, text):
+    return hashlib.sha1(f'{source}:{text}'.encode()).hexdigest()[:16]
+
+def compile_callable(expr, source='parser'):
+    # source 'parser' goes through our tokenizer/postfix (same syntax as
+    # /calculate); 'sympy' sympifies the text as /equation does. Returns the
+    # registry entry: {'id', 'expression', 'source', 'variables', 'func'}.
+    text = normalize_expression(expr)
+    expr_id = _expression_id(source, text)
+    entry = compiled_functions.get(expr_id)
+    if entry is not None:
+        return entry
+    if source == 'parser':
+        compiled = compile_expression(text)
+        if compiled['assign_var']:
+            raise ValueError('Assignments cannot be compiled')
+        sym_expr = postfix_to_sympy(compiled['postfix'])
+    elif source == 'sympy':
+        sym_expr = sympy.sympify(insert_mult(text))
+    else:
+        raise ValueError(f'Unknown source: {source}')
+    # Remaining powers (sqrt, and 1/x from sympify) print as ** otherwise
+    sym_expr = sym_expr.replace(sympy.Pow, lambda base, exponent: POWER(base, exponent))
+    variables = sorted(sym_expr.free_symbols, key=lambda s: s.name)
+    func = sympy.lambdify(variables, sym_expr, modules=[NUMPY_OVERRIDES, 'numpy'])
+    entry = {
+        'id': expr_id,
+        'expression': text,
+        'source': source,
+        'variables': [s.name for s in variables],
+        'func': func
+    }
+    compiled_functions.put(expr_id, entry)
+    return entry
+
+def evaluate_compiled(entry, bindings, scope=None):
+    # Unbound variables fall back to scope, e.g. the session's stored variables
+    args = []
+    for name in entry['variables']:
+        if name in bindings:
+            value = bindings[name]
+        elif scope is not None and name in scope:
+            value = scope[name]
+        else:
+            raise ValueError(f"Variable '{name}' not defined")
+        args.append(np.asarray(value, dtype=np.complex128 if np.iscomplexobj(value) else np.float64))
+    with np.errstate(all='ignore'):
+        values = np.asarray(entry['func'](*args))
+    return np.broadcast_to(values, np.broadcast_shapes(values.shape, *(a.shape for a in args)))
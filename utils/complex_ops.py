@@ -0,0 +1,106 @@
+import numpy as np
+
+__all__ = ['COMPLEX_OPS', 'parse_operand', 'run_complex', 'to_columns']
+
+# Complex arithmetic over NumPy complex128 arrays, for /complex and
+# /complex_batch. Elements whose result is undefined (division by zero,
+# 0 to a negative power, overflow) are masked instead of failing the batch.
+
+def _parse_text(text):
+    # '3+4i', '-2i', 'i', '5'; empty means 0 as in the single-pair form
+    text = str(text).replace(' ', '').replace('i', 'j')
+    if not text:
+        return 0j
+    try:
+        return complex(text)
+    except ValueError:
+        raise ValueError(f'Invalid complex number: {text.replace("j", "i")}')
+
+def parse_operand(value, degrees=False):
+    # A number or string, a list of them, {'re': [...], 'im': [...]} columns,
+    # or polar {'r': [...], 'theta': [...]} (theta in degrees with degrees=True)
+    if value is None:
+        return np.zeros((), dtype=np.complex128)
+    if isinstance(value, dict):
+        if 'r' in value or 'theta' in value:
+            r = np.asarray(value.get('r', 1), dtype=float)
+            theta = np.asarray(value.get('theta', 0), dtype=float)
+            if degrees:
+                theta = np.deg2rad(theta)
+            return r * np.exp(1j * theta)
+        re = np.asarray(value.get('re', 0), dtype=float)
+        im = np.asarray(value.get('im', 0), dtype=float)
+        return re + 1j * im
+    if isinstance(value, list):
+        if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value):
+            return np.asarray(value, dtype=np.complex128)
+        return np.array([v if isinstance(v, (int, float)) else _parse_text(v) for v in value], dtype=np.complex128)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return np.asarray(value, dtype=np.complex128)
+    return np.asarray(_parse_text(value), dtype=np.complex128)
+
+def _divide(a, b):
+    zero = b == 0
+    return np.divide(a, np.where(zero, 1, b)), zero
+
+def _no_mask(func):
+    def op(*args):
+        return func(*args), None
+    return op
+
+# Operation name -> (arity, function(*operands) -> (values, mask or None))
+COMPLEX_OPS = {
+    'add': (2, _no_mask(np.add)),
+    'subtract': (2, _no_mask(np.subtract)),
+    'multiply': (2, _no_mask(np.multiply)),
+    'divide': (2, _divide),
+    'pow': (2, _no_mask(np.power)),
+    'mod': (1, _no_mask(np.abs)),
+    'conj': (1, _no_mask(np.conj)),
+    'arg': (1, _no_mask(np.angle)),
+    'exp': (1, _no_mask(np.exp)),
+}
+
+def run_complex(op, z1, z2=None, degrees=False):
+    # Returns (values, mask): values broadcast over the operands, mask marks
+    # elements with no finite result
+    if op not in COMPLEX_OPS:
+        raise ValueError('Unknown operation')
+    arity, func = COMPLEX_OPS[op]
+    operands = [parse_operand(z1, degrees)]
+    if arity == 2:
+        operands.append(parse_operand(z2, degrees))
+        try:
+            np.broadcast_shapes(operands[0].shape, operands[1].shape)
+        except ValueError:
+            raise ValueError('z1 and z2 must have the same length')
+    with np.errstate(all='ignore'):
+        values, mask = func(*operands)
+    if op == 'arg' and degrees:
+        values = np.rad2deg(values)
+    bad = ~np.isfinite(values)
+    mask = bad if mask is None else (mask | bad)
+    return values, np.broadcast_to(mask, np.shape(values))
+
+def _column(values, masked):
+    column = values.tolist()
+    for i in masked:
+        column[i] = None
+    return column
+
+def to_columns(values, mask, output='rect', degrees=False):
+    # {'re': [...], 'im': [...]} or, with output='polar', {'r': [...], 'theta': [...]};
+    # masked elements are null and their indices are listed under 'masked'
+    values = np.atleast_1d(values).ravel()
+    masked = np.flatnonzero(mask).tolist()
+    if output == 'polar':
+        theta = np.angle(values, deg=bool(degrees))
+        columns = {'r': _column(np.abs(values), masked), 'theta': _column(theta, masked)}
+    elif output == 'rect':
+        values = values.astype(np.complex128, copy=False)
+        columns = {'re': _column(values.real, masked), 'im': _column(values.imag, masked)}
+    else:
+        raise ValueError(f'Unknown output form: {output}')
+    columns['count'] = len(values)
+    columns['masked'] = masked
+    return columns
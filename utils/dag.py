@@ -0,0 +1,120 @@
+import utils.evaluator as evaluator
+import utils.parser as parser
+
+__all__ = ['ExpressionDag', 'build_dag', 'evaluate', 'tree_json']
+
+# Hash-consed form of a parsed expression: structurally identical subtrees
+# become one node, so sin(x)^2 + cos(x)^2 + sin(x)*cos(x) holds one sin(x)
+# and one cos(x). Nodes are kept children-first, so evaluating them in
+# order computes each shared subexpression once.
+
+OPERANDS = ('num', 'imag', 'const', 'var')
+
+class ExpressionDag:
+    __slots__ = ('nodes', 'saved')
+
+    def __init__(self, nodes, saved):
+        # nodes: (opcode, token, payload, left, right, dead) instructions, where
+        # left/right index earlier nodes (-1 for none) and dead lists the nodes
+        # whose last reader this is. saved is how many operator evaluations
+        # sharing saves over the plain tree.
+        self.nodes = nodes
+        self.saved = saved
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def evaluate(self, scope, opcodes=evaluator.OPCODES):
+        # Same result as evaluator.run_program on the postfix it was built
+        # from; opcodes may be the scalar table or a vectorized one. Values
+        # are dropped after their last use, so arrays don't pile up.
+        values = [None] * len(self.nodes)
+        for i, (opcode, token, payload, left, right, dead) in enumerate(self.nodes):
+            if opcode == 'var':
+                if payload not in scope:
+                    raise ValueError(f"Variable '{payload}' not defined")
+                values[i] = scope[payload]
+            elif opcode in OPERANDS:
+                values[i] = payload
+            elif right < 0:
+                values[i] = opcodes[opcode][1](values[left])
+            else:
+                values[i] = opcodes[opcode][1](values[left], values[right])
+            for d in dead:
+                values[d] = None
+        return values[-1]
+
+    def to_arrays(self):
+        # Same flat form as TreeNode.to_arrays (root at index 0, parents
+        # before children, -1 for no child), except that a shared subtree
+        # is listed once and every parent refers to the same index
+        last = len(self.nodes) - 1
+        values = []
+        left = []
+        right = []
+        for opcode, token, payload, l, r, dead in reversed(self.nodes):
+            values.append(token)
+            left.append(last - l if l >= 0 else -1)
+            right.append(last - r if r >= 0 else -1)
+        return {'values': values, 'left': left, 'right': right}
+
+def build_dag(postfix):
+    index = {}
+    nodes = []
+    stack = []
+    operators = []  # operator count of each node's subtree, as a plain tree
+    for token in postfix:
+        kind = parser.token_kind(token)
+        if kind in ('number', 'imag', 'const', 'var'):
+            key = (token, -1, -1)
+            count = 0
+        elif kind == 'binary':
+            right = stack.pop()
+            left = stack.pop()
+            key = (token, left, right)
+            count = operators[left] + operators[right] + 1
+        elif kind == 'unary':
+            key = (token, stack.pop(), -1)
+            count = operators[key[1]] + 1
+        else:
+            raise ValueError(f'Unknown token in tree: {token}')
+        node = index.get(key)
+        if node is None:
+            node = index[key] = len(nodes)
+            nodes.append(key)
+            operators.append(count)
+        stack.append(node)
+    if len(stack) != 1:
+        raise ValueError('Invalid expression for tree')
+    # The root is the last node added, since no subtree can equal the whole
+    saved = operators[stack[0]] - sum(1 for _, left, _ in nodes if left >= 0)
+    last_use = {}
+    for i, (_, left, right) in enumerate(nodes):
+        if left >= 0:
+            last_use[left] = i
+        if right >= 0:
+            last_use[right] = i
+    dead = [[] for _ in nodes]
+    for node, i in last_use.items():
+        dead[i].append(node)
+    program = []
+    for i, (token, left, right) in enumerate(nodes):
+        opcode, _, payload = parser.compile_postfix([token])[0] if left < 0 else (token, token, None)
+        program.append((opcode, token, payload, left, right, tuple(dead[i])))
+    return ExpressionDag(program, saved)
+
+def evaluate(compiled, scope):
+    # Untraced evaluation of a compile_expression() entry: through its DAG
+    # when the expression repeats subterms, else the constant-folded program
+    if compiled['dag'] is not None:
+        return compiled['dag'].evaluate(scope)
+    result, _, _ = evaluator.run_program(compiled['optimized'], scope=scope)
+    return result
+
+def tree_json(compiled):
+    # The expression tree (as written, before constant folding) with repeated
+    # subtrees shared, built on first request and kept with the entry
+    tree = compiled.get('tree_dag')
+    if tree is None:
+        tree = compiled['tree_dag'] = build_dag(compiled['postfix']).to_arrays()
+    return tree
@@ -1,198 +1,134 @@
 import math
-import re
+import operator
+
+import utils.parser as parser
 
 # Variable storage (in-memory for now)
 variables = {}
-__all__ = ['evaluate_postfix', 'get_variables', 'get_evaluation_steps', 'variables']
+__all__ = ['evaluate', 'run_program', 'iter_steps', 'evaluate_postfix', 'get_variables', 'get_evaluation_steps', 'variables']
 
-def parse_complex(token):
-    # Accepts '2i', '-3.5i', '1i', 'i', etc.
-    if token.endswith('i'):
-        val = token[:-1]
-        if val == '' or val == '+':
-            return complex(0, 1)
-        elif val == '-':
-            return complex(0, -1)
-        else:
-            return complex(0, float(val))
-    return None
+def _divide(a, b):
+    if b == 0:
+        raise ValueError('Division by zero')
+    return a / b
 
-def evaluate_postfix(postfix, assign_var=None):
-    stack = []
-    for token in postfix:
-        if token.endswith('i'):
-            stack.append(parse_complex(token))
-        elif re.match(r'\d+\.\d+|\d+', token):
-            stack.append(float(token))
-        elif re.match(r'^[a-zA-Z]$', token):
-            # Variable usage
-            if token in variables:
-                stack.append(variables[token])
+def _log(a):
+    if a <= 0:
+        raise ValueError('Logarithm domain error')
+    return math.log(a)
+
+def _log10(a):
+    if a <= 0:
+        raise ValueError('Logarithm domain error')
+    return math.log10(a)
+
+def _sqrt(a):
+    if a < 0:
+        return complex(0, math.sqrt(-a))
+    return math.sqrt(a)
+
+def _conj(a):
+    return a.conjugate() if hasattr(a, 'conjugate') else a
+
+# Opcode table: opcode -> (arity, function, step format).
+# Operands have arity 0 and push their payload; 'var' is looked up in the scope.
+OPCODES = {
+    'num': (0, None, '{token}'),
+    'const': (0, None, '{token}'),
+    'imag': (0, None, '{token} = {res}'),
+    'var': (0, None, '{token} = {res}'),
+    '+': (2, operator.add, '{a} + {b} = {res}'),
+    '-': (2, operator.sub, '{a} - {b} = {res}'),
+    '*': (2, operator.mul, '{a} * {b} = {res}'),
+    '/': (2, _divide, '{a} / {b} = {res}'),
+    '^': (2, operator.pow, '{a} ^ {b} = {res}'),
+    '**': (2, operator.pow, '{a} ^ {b} = {res}'),
+    'sin': (1, math.sin, 'sin({a}) = {res}'),
+    'cos': (1, math.cos, 'cos({a}) = {res}'),
+    'tan': (1, math.tan, 'tan({a}) = {res}'),
+    'log': (1, _log, 'log({a}) = {res}'),
+    'log10': (1, _log10, 'log10({a}) = {res}'),
+    'sqrt': (1, _sqrt, 'sqrt({a}) = {res}'),
+    'exp': (1, math.exp, 'exp({a}) = {res}'),
+    'asin': (1, math.asin, 'asin({a}) = {res}'),
+    'acos': (1, math.acos, 'acos({a}) = {res}'),
+    'atan': (1, math.atan, 'atan({a}) = {res}'),
+    'abs': (1, abs, '|{a}| = {res}'),
+    'mod': (1, abs, '|{a}| = {res}'),
+    'conj': (1, _conj, 'conj({a}) = {res}'),
+    'neg': (1, operator.neg, 'neg({a}) = {res}'),
+}
+
+def _execute(program, scope, opcodes, stack, start=0):
+    # The evaluation loop behind run_program and iter_steps: runs program on
+    # stack, yielding the formatted step of each opcode from index start on
+    # (steps before start are evaluated but not formatted).
+    push = stack.append
+    pop = stack.pop
+    a = b = None
+    for i, (opcode, token, value) in enumerate(program):
+        arity, func, fmt = opcodes[opcode]
+        if arity == 0:
+            if opcode == 'var':
+                if value not in scope:
+                    raise ValueError(f"Variable '{value}' not defined")
+                res = scope[value]
             else:
-                raise ValueError(f"Variable '{token}' not defined")
-        elif token == 'pi':
-            stack.append(math.pi)
-        elif token == 'e':
-            stack.append(math.e)
-        elif token in {'+', '-', '*', '/', '^', '**'}:
-            b = stack.pop()
-            a = stack.pop()
-            if token in {'^', '**'}:
-                stack.append(a ** b)
-            elif token == '+':
-                stack.append(a + b)
-            elif token == '-':
-                stack.append(a - b)
-            elif token == '*':
-                stack.append(a * b)
-            elif token == '/':
-                if b == 0:
-                    raise ValueError('Division by zero')
-                stack.append(a / b)
-        elif token in {'mod', 'abs'}:
-            a = stack.pop()
-            stack.append(abs(a))
-        elif token == 'conj':
-            a = stack.pop()
-            stack.append(a.conjugate() if hasattr(a, 'conjugate') else a)
-        elif token in {'sin', 'cos', 'tan', 'log', 'log10', 'sqrt', 'exp', 'asin', 'acos', 'atan'}:
-            a = stack.pop()
-            if token == 'sin':
-                stack.append(math.sin(a))
-            elif token == 'cos':
-                stack.append(math.cos(a))
-            elif token == 'tan':
-                stack.append(math.tan(a))
-            elif token == 'log':
-                if a <= 0:
-                    raise ValueError('Logarithm domain error')
-                stack.append(math.log(a))
-            elif token == 'log10':
-                if a <= 0:
-                    raise ValueError('Logarithm domain error')
-                stack.append(math.log10(a))
-            elif token == 'sqrt':
-                if a < 0:
-                    stack.append(complex(0, math.sqrt(-a)))
-                else:
-                    stack.append(math.sqrt(a))
-            elif token == 'exp':
-                stack.append(math.exp(a))
-            elif token == 'asin':
-                stack.append(math.asin(a))
-            elif token == 'acos':
-                stack.append(math.acos(a))
-            elif token == 'atan':
-                stack.append(math.atan(a))
-        elif token == 'neg':
-            a = stack.pop()
-            stack.append(-a)
+                res = value
+        elif arity == 1:
+            a = pop()
+            res = func(a)
         else:
-            raise ValueError(f'Unknown token in evaluation: {token}')
+            b = pop()
+            a = pop()
+            res = func(a, b)
+        push(res)
+        if i >= start:
+            yield fmt.format(token=token, a=a, b=b, res=res)
     if len(stack) != 1:
         raise ValueError('Invalid expression for evaluation')
+
+def run_program(program, assign_var=None, trace=False, scope=None, opcodes=OPCODES):
+    # Single walk over a compiled program (see parser.compile_postfix):
+    # returns (result, assigned, steps). Steps are only formatted when
+    # trace is set; otherwise steps is None. Variables are read from (and
+    # assigned into) scope, which defaults to the module-level variables.
+    # opcodes swaps in another number type's table (see utils/numeric.py).
+    if scope is None:
+        scope = variables
+    stack = []
+    if trace:
+        steps = list(_execute(program, scope, opcodes, stack))
+    else:
+        steps = None
+        # Starting past the end formats nothing, so this yields no steps
+        for _ in _execute(program, scope, opcodes, stack, start=len(program)):
+            pass
     result = stack[0]
     # Assignment: store variable if needed
     if assign_var:
-        variables[assign_var] = result
-        return result, assign_var
-    return result, None
+        scope[assign_var] = result
+        return result, assign_var, steps
+    return result, None, steps
+
+def iter_steps(program, scope=None, start=0, opcodes=OPCODES):
+    # Generator form of run_program(trace=True): yields one formatted step per
+    # opcode, from index start on, so a trace can be streamed (or cut short)
+    # without building the whole list.
+    if scope is None:
+        scope = variables
+    return _execute(program, scope, opcodes, [], start)
+
+def evaluate(postfix, assign_var=None, trace=False, scope=None):
+    return run_program(parser.compile_postfix(postfix), assign_var, trace, scope)
+
+def evaluate_postfix(postfix, assign_var=None):
+    result, assigned, _ = evaluate(postfix, assign_var)
+    return result, assigned
 
 def get_variables():
     return variables.copy()
 
 def get_evaluation_steps(postfix):
-    stack = []
-    steps = []
-    for token in postfix:
-        if token.endswith('i'):
-            val = parse_complex(token)
-            stack.append(val)
-            steps.append(f"{token} = {val}")
-        elif token.replace('.', '', 1).isdigit():
-            stack.append(float(token))
-            steps.append(f"{token}")
-        elif re.match(r'^[a-zA-Z]$', token):
-            # Variable usage
-            if token in variables:
-                stack.append(variables[token])
-                steps.append(f"{token} = {variables[token]}")
-            else:
-                raise ValueError(f"Variable '{token}' not defined")
-        elif token == 'pi':
-            stack.append(math.pi)
-            steps.append("pi")
-        elif token == 'e':
-            stack.append(math.e)
-            steps.append("e")
-        elif token in {'+', '-', '*', '/', '^', '**'}:
-            b = stack.pop()
-            a = stack.pop()
-            if token == '+':
-                res = a + b
-                steps.append(f"{a} + {b} = {res}")
-            elif token == '-':
-                res = a - b
-                steps.append(f"{a} - {b} = {res}")
-            elif token == '*':
-                res = a * b
-                steps.append(f"{a} * {b} = {res}")
-            elif token == '/':
-                res = a / b
-                steps.append(f"{a} / {b} = {res}")
-            elif token in {'^', '**'}:
-                res = a ** b
-                steps.append(f"{a} ^ {b} = {res}")
-            stack.append(res)
-        elif token in {'mod', 'abs'}:
-            a = stack.pop()
-            res = abs(a)
-            steps.append(f"|{a}| = {res}")
-            stack.append(res)
-        elif token == 'conj':
-            a = stack.pop()
-            res = a.conjugate() if hasattr(a, 'conjugate') else a
-            steps.append(f"conj({a}) = {res}")
-            stack.append(res)
-        elif token in {'sin', 'cos', 'tan', 'log', 'log10', 'sqrt', 'exp', 'asin', 'acos', 'atan'}:
-            a = stack.pop()
-            if token == 'sin':
-                res = math.sin(a)
-                steps.append(f"sin({a}) = {res}")
-            elif token == 'cos':
-                res = math.cos(a)
-                steps.append(f"cos({a}) = {res}")
-            elif token == 'tan':
-                res = math.tan(a)
-                steps.append(f"tan({a}) = {res}")
-            elif token == 'log':
-                res = math.log(a)
-                steps.append(f"log({a}) = {res}")
-            elif token == 'log10':
-                res = math.log10(a)
-                steps.append(f"log10({a}) = {res}")
-            elif token == 'sqrt':
-                if a < 0:
-                    res = complex(0, math.sqrt(-a))
-                else:
-                    res = math.sqrt(a)
-                steps.append(f"sqrt({a}) = {res}")
-            elif token == 'exp':
-                res = math.exp(a)
-                steps.append(f"exp({a}) = {res}")
-            elif token == 'asin':
-                res = math.asin(a)
-                steps.append(f"asin({a}) = {res}")
-            elif token == 'acos':
-                res = math.acos(a)
-                steps.append(f"acos({a}) = {res}")
-            elif token == 'atan':
-                res = math.atan(a)
-                steps.append(f"atan({a}) = {res}")
-            stack.append(res)
-        elif token == 'neg':
-            a = stack.pop()
-            res = -a
-            steps.append(f"neg({a}) = {res}")
-            stack.append(res)
-    return steps 
\ No newline at end of file
+    _, _, steps = evaluate(postfix, trace=True)
+    return steps
@@ -0,0 +1,5 @@
+__all__ = ['json_value']
+
+def json_value(value):
+    # Complex results are not JSON serializable; send them the way steps print them
+    return str(value) if isinstance(value, complex) else value
@@ -0,0 +1,154 @@
+import importlib
+import importlib.abc
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import utils.metrics as metrics
+
+__all__ = ['LAZY_IMPORTS', 'lazy_import', 'record_import', 'prewarm', 'startup_report']
+
+# Defer heavy modules (numpy, sympy, mpmath and the routes built on them)
+# until a request first needs them. On by default on Vercel, where every
+# cold start would otherwise pay for sympy before serving /calculate.
+LAZY_IMPORTS = os.environ.get('LAZY_IMPORTS', '1' if os.environ.get('VERCEL') else '0') == '1'
+# In lazy mode, import the deferred modules in a background thread after the first request
+PREWARM_IMPORTS = os.environ.get('PREWARM_IMPORTS', '1') == '1'
+# Third-party packages timed on their own, so a module isn't charged for
+# numpy just because it happened to be the first to import it
+HEAVY_DEPENDENCIES = ('numpy', 'scipy', 'sympy', 'mpmath')
+
+_import_times = {}
+_registered = []
+_lock = threading.Lock()
+_prewarm_state = 'idle'
+_frames = threading.local()  # per-thread stack of time spent in nested timed imports
+
+def record_import(name, elapsed):
+    # First-import time of a module
+    with _lock:
+        if name in _import_times:
+            return
+        _import_times[name] = elapsed
+    metrics.observe_stage(f'import:{name}', elapsed)
+
+@contextmanager
+def _timed(name):
+    # Records the import of name, less any timed imports nested in it (a
+    # heavy dependency, or another deferred module)
+    stack = _frames.__dict__.setdefault('stack', [])
+    stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+    record_import(name, elapsed - nested)
+
+class _TimedLoader(importlib.abc.Loader):
+    # Wraps a timed module's loader for its first import only
+    def __init__(self, loader):
+        self.loader = loader
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        module.__spec__.loader = module.__loader__ = self.loader
+        with _timed(module.__name__):
+            self.loader.exec_module(module)
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    # Times the first import of the heavy dependencies and of the deferred
+    # modules, whichever module triggers it
+    def find_spec(self, fullname, path, target=None):
+        if fullname in _import_times or (fullname not in HEAVY_DEPENDENCIES and fullname not in _registered):
+            return None
+        for finder in sys.meta_path:
+            if finder is not self and hasattr(finder, 'find_spec'):
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+        else:
+            return None
+        if hasattr(spec.loader, 'exec_module'):
+            spec.loader = _TimedLoader(spec.loader)
+        return spec
+
+sys.meta_path.insert(0, _ImportTimer())
+
+def _load(name):
+    return importlib.import_module(name)
+
+class _Lazy:
+    # Stands in for a module, or one of its attributes, until first use
+    def __init__(self, module, attr=None):
+        self._module = module
+        self._attr = attr
+        self._target = None
+
+    def _resolve(self):
+        target = self._target
+        if target is None:
+            target = _load(self._module)
+            if self._attr:
+                target = getattr(target, self._attr)
+            self._target = target
+        return target
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+    def __repr__(self):
+        name = f'{self._module}.{self._attr}' if self._attr else self._module
+        return f'<lazy {name}{" (loaded)" if self._target is not None else ""}>'
+
+def lazy_import(module, attr=None):
+    # lazy_import('utils.solver') ~ import utils.solver as solver;
+    # lazy_import('utils.matrix_store', 'matrix_store') ~ from ... import matrix_store.
+    # Imports right away unless LAZY_IMPORTS is set.
+    with _lock:
+        if module not in _registered:
+            _registered.append(module)
+    proxy = _Lazy(module, attr)
+    return proxy if LAZY_IMPORTS else proxy._resolve()
+
+def prewarm():
+    # Import every registered module in a daemon thread, once
+    global _prewarm_state
+    with _lock:
+        if _prewarm_state != 'idle':
+            return
+        _prewarm_state = 'running'
+        pending = list(_registered)
+
+    def run():
+        global _prewarm_state
+        for name in pending:
+            try:
+                _load(name)
+            except Exception:
+                pass
+        _prewarm_state = 'done'
+
+    threading.Thread(target=run, name='prewarm-imports', daemon=True).start()
+
+def startup_report():
+    with _lock:
+        times = dict(_import_times)
+        registered = list(_registered)
+        state = _prewarm_state
+    return {
+        'lazy_imports': LAZY_IMPORTS,
+        'prewarm': state if LAZY_IMPORTS and PREWARM_IMPORTS else 'disabled',
+        'import_seconds': times,
+        'pending': [name for name in registered if name not in sys.modules]
+    }
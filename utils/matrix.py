@@ -0,0 +1,216 @@
+import base64
+import io
+
+import numpy as np
+
+__all__ = [
+    'MatrixError', 'OPERATIONS', 'decode_operand', 'encode_array', 'run_operation',
+    'result_to_json', 'result_to_npy'
+]
+
+NPY_MIMETYPE = 'application/x-npy'
+NPZ_MIMETYPE = 'application/x-npz'
+
+# Condition numbers above this mean a solve or inverse has lost most of its precision
+ILL_CONDITIONED = 1 / np.finfo(float).eps
+# The condition number costs an SVD, so by default it is only checked up to this size
+CONDITION_CHECK_MAX = 512
+
+class MatrixError(ValueError):
+    pass
+
+# Operands
+
+def decode_operand(value):
+    # Accepts nested lists, {'shape': [...], 'data': <base64 float64 buffer>}
+    # (little-endian, C order) or raw .npy bytes. Binary forms are wrapped
+    # with np.frombuffer/np.load rather than copied element by element.
+    if value is None:
+        return np.array([], dtype=float)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return np.load(io.BytesIO(value), allow_pickle=False)
+    if isinstance(value, dict):
+        shape = tuple(value.get('shape', ()))
+        dtype = np.dtype(value.get('dtype', 'float64')).newbyteorder('<')
+        buffer = base64.b64decode(value.get('data', ''))
+        array = np.frombuffer(buffer, dtype=dtype)
+        if array.size != int(np.prod(shape)):
+            raise MatrixError('Matrix data does not match its shape.')
+        return array.reshape(shape)
+    return np.array(value, dtype=float)
+
+def encode_array(array):
+    # Inverse of the dict form accepted by decode_operand
+    array = np.ascontiguousarray(array)
+    dtype = array.dtype.newbyteorder('<')
+    return {
+        'shape': list(array.shape),
+        'dtype': dtype.name,
+        'data': base64.b64encode(array.astype(dtype, copy=False).tobytes()).decode('ascii')
+    }
+
+# Operations
+
+def _require_square(M, name, what):
+    if M.ndim != 2 or M.shape[0] != M.shape[1]:
+        raise MatrixError(f'{name} must be square for {what}.')
+
+def _condition(M, warnings):
+    # Condition number, or None for a singular matrix (JSON has no Infinity)
+    cond = float(np.linalg.cond(M))
+    if not np.isfinite(cond):
+        warnings.append('Matrix is singular (condition number is infinite); results may be inaccurate.')
+        return None
+    if cond > ILL_CONDITIONED:
+        warnings.append(f'Matrix is ill-conditioned (condition number {cond:.3g}); results may be inaccurate.')
+    return cond
+
+def _add(A, B, info):
+    if A.shape != B.shape:
+        raise MatrixError('Matrix sizes must match for addition.')
+    return A + B
+
+def _subtract(A, B, info):
+    if A.shape != B.shape:
+        raise MatrixError('Matrix sizes must match for subtraction.')
+    return A - B
+
+def _multiply(A, B, info):
+    if A.shape[1] != B.shape[0]:
+        raise MatrixError('A columns must match B rows for multiplication.')
+    return A @ B
+
+def _det(name):
+    def op(A, B, info):
+        M = A if name == 'A' else B
+        _require_square(M, name, 'determinant')
+        return float(np.linalg.det(M))
+    return op
+
+def _inv(name):
+    def op(A, B, info):
+        M = A if name == 'A' else B
+        _require_square(M, name, 'inverse')
+        if info['check_condition']:
+            info['condition'] = _condition(M, info['warnings'])
+        return np.linalg.inv(M)
+    return op
+
+def _trans(name):
+    def op(A, B, info):
+        return (A if name == 'A' else B).T
+    return op
+
+def _solve(A, B, info):
+    # x with A x = B, without forming inv(A)
+    _require_square(A, 'A', 'solve')
+    if B.ndim == 0 or B.shape[0] != A.shape[0]:
+        raise MatrixError('B rows must match A rows to solve.')
+    if info['check_condition']:
+        info['condition'] = _condition(A, info['warnings'])
+    return np.linalg.solve(A, B)
+
+def _lu_decompose(A):
+    # Doolittle LU with partial pivoting: P @ A = L @ U (used when SciPy is missing)
+    n = A.shape[0]
+    U = A.astype(float).copy()
+    L = np.eye(n)
+    perm = np.arange(n)
+    for k in range(n - 1):
+        pivot = k + int(np.argmax(np.abs(U[k:, k])))
+        if pivot != k:
+            U[[k, pivot], k:] = U[[pivot, k], k:]
+            L[[k, pivot], :k] = L[[pivot, k], :k]
+            perm[[k, pivot]] = perm[[pivot, k]]
+        if U[k, k] == 0:
+            continue
+        factors = U[k + 1:, k] / U[k, k]
+        L[k + 1:, k] = factors
+        U[k + 1:, k:] -= np.outer(factors, U[k, k:])
+    P = np.eye(n)[perm]
+    return P, L, U
+
+def _lu(A, B, info):
+    _require_square(A, 'A', 'LU decomposition')
+    if info['check_condition']:
+        info['condition'] = _condition(A, info['warnings'])
+    try:
+        from scipy.linalg import lu
+    except ImportError:
+        P, L, U = _lu_decompose(A)
+    else:
+        # SciPy returns A = P @ L @ U; report P so that P @ A = L @ U either way
+        P, L, U = lu(A)
+        P = P.T
+    return {'P': P, 'L': L, 'U': U}
+
+def _qr(A, B, info):
+    Q, R = np.linalg.qr(A)
+    return {'Q': Q, 'R': R}
+
+def _eig(A, B, info):
+    _require_square(A, 'A', 'eigen decomposition')
+    values, vectors = np.linalg.eig(A)
+    return {'values': values, 'vectors': vectors}
+
+def _svd(A, B, info):
+    U, S, Vt = np.linalg.svd(A)
+    return {'U': U, 'S': S, 'Vt': Vt}
+
+# Operation name -> function(A, B, info); B-only variants mirror the A ones
+OPERATIONS = {
+    'add': _add,
+    'subtract': _subtract,
+    'multiply': _multiply,
+    'detA': _det('A'),
+    'detB': _det('B'),
+    'invA': _inv('A'),
+    'invB': _inv('B'),
+    'transA': _trans('A'),
+    'transB': _trans('B'),
+    'solve': _solve,
+    'lu': _lu,
+    'qr': _qr,
+    'eig': _eig,
+    'svd': _svd,
+}
+
+def run_operation(op, A, B, check_condition=None):
+    # Returns (result, info); info holds 'warnings' and, for solve/inv/lu, 'condition'.
+    # check_condition=None checks matrices up to CONDITION_CHECK_MAX rows.
+    if op not in OPERATIONS:
+        raise MatrixError('Unknown operation.')
+    if check_condition is None:
+        check_condition = max(A.shape[:1] + B.shape[:1], default=0) <= CONDITION_CHECK_MAX
+    info = {'warnings': [], 'check_condition': check_condition}
+    result = OPERATIONS[op](A, B, info)
+    del info['check_condition']
+    return result, info
+
+# Results
+
+def _array_json(value, binary):
+    if binary:
+        return encode_array(value)
+    if np.iscomplexobj(value):
+        if not np.any(value.imag):
+            return value.real.tolist()
+        return {'re': value.real.tolist(), 'im': value.imag.tolist()}
+    return value.tolist()
+
+def result_to_json(result, binary=False):
+    # binary=True sends arrays as base64 float64 buffers with their shape
+    if isinstance(result, dict):
+        return {name: _array_json(value, binary) for name, value in result.items()}
+    if isinstance(result, np.ndarray):
+        return _array_json(result, binary)
+    return result
+
+def result_to_npy(result):
+    # (bytes, mimetype): .npy for a single array, .npz for decompositions
+    out = io.BytesIO()
+    if isinstance(result, dict):
+        np.savez(out, **result)
+        return out.getvalue(), NPZ_MIMETYPE
+    np.save(out, np.asarray(result), allow_pickle=False)
+    return out.getvalue(), NPY_MIMETYPE
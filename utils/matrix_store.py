@@ -0,0 +1,263 @@
+import os
+import secrets
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import utils.metrics as metrics
+from utils.matrix import MatrixError, decode_operand, run_operation
+
+__all__ = ['MatrixStore', 'matrix_store', 'store_result', 'run_pipeline']
+
+# Bytes of matrix data kept in memory before least-recently-used handles are
+# spilled to MATRIX_SPILL_DIR (or dropped, when no spill directory is set)
+MATRIX_STORE_BYTES = int(os.environ.get('MATRIX_STORE_BYTES', 256 * 1024 * 1024))
+MATRIX_SPILL_DIR = os.environ.get('MATRIX_SPILL_DIR', '')
+# Bytes of spilled data kept on disk before the oldest spilled handles are dropped
+MATRIX_SPILL_BYTES = int(os.environ.get('MATRIX_SPILL_BYTES', 4 * 1024 * 1024 * 1024))
+MAX_PIPELINE_STEPS = 64
+
+# Uploaded and stored matrices by handle. Arrays are read-only once stored, so
+# they can be handed to operations without copying; spilled arrays are saved
+# as .npy files and memory-mapped back on access.
+class MatrixStore:
+    def __init__(self, max_bytes, spill_dir='', max_spill_bytes=0):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self.memory_bytes = 0
+        self.spill_bytes = 0
+        self.spills = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def put(self, array):
+        if array.dtype == object:
+            raise MatrixError('Only numeric matrices can be stored.')
+        if array.flags.writeable or isinstance(array, np.memmap):
+            array = np.array(array)
+        array.flags.writeable = False
+        if array.nbytes > self.max_bytes and not self.spill_dir:
+            raise MatrixError('Matrix is too large for the store.')
+        handle = secrets.token_hex(8)
+        entry = {'array': array, 'path': None, 'nbytes': array.nbytes}
+        with self._lock:
+            self._entries[handle] = entry
+            self.memory_bytes += array.nbytes
+            spills, removals = self._trim()
+        # Disk I/O happens outside the lock, so lookups don't wait on it
+        self._write_spills(spills)
+        _remove_files(removals)
+        return handle
+
+    def get(self, handle):
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None:
+                raise MatrixError(f'Unknown matrix handle: {handle}')
+            self._entries.move_to_end(handle)
+            array, path = entry['array'], entry['path']
+        if array is not None:
+            return array
+        try:
+            return np.load(path, mmap_mode='r')
+        except FileNotFoundError:
+            # Deleted or evicted since the lookup
+            raise MatrixError(f'Unknown matrix handle: {handle}') from None
+
+    def info(self, handle):
+        array = self.get(handle)
+        with self._lock:
+            spilled = handle in self._entries and self._entries[handle]['path'] is not None
+        return {
+            'handle': handle,
+            'shape': list(array.shape),
+            'dtype': array.dtype.name,
+            'nbytes': int(array.nbytes),
+            'spilled': spilled
+        }
+
+    def delete(self, handle):
+        with self._lock:
+            entry = self._entries.pop(handle, None)
+            if entry is None:
+                return False
+            path = self._forget(entry)
+        _remove_files([path])
+        return True
+
+    def resolve(self, value):
+        # An operand given as {'handle': ...}, or any form decode_operand accepts
+        if isinstance(value, dict) and 'handle' in value:
+            return self.get(str(value['handle']))
+        return decode_operand(value)
+
+    def clear(self):
+        with self._lock:
+            removals = [self._forget(entry) for entry in self._entries.values()]
+            self._entries.clear()
+            self.spills = self.evictions = 0
+        _remove_files(removals)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'spilled': sum(1 for e in self._entries.values() if e['path'] is not None),
+                'memory_bytes': self.memory_bytes,
+                'max_bytes': self.max_bytes,
+                'spill_bytes': self.spill_bytes,
+                'max_spill_bytes': self.max_spill_bytes,
+                'spills': self.spills,
+                'evictions': self.evictions
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, handle):
+        return handle in self._entries
+
+    def _forget(self, entry):
+        # Drops entry's bytes from the totals; returns its file to remove
+        # (after the lock is released), or None
+        if entry['path'] is None:
+            self.memory_bytes -= entry['nbytes']
+            return None
+        self.spill_bytes -= entry['nbytes']
+        return entry['path']
+
+    def _trim(self):
+        # Oldest in-memory entries go to disk first; the oldest spilled
+        # entries are dropped once the disk budget is used up too. Called
+        # with the lock held; returns ([(handle, entry)] to write, [paths]
+        # to remove), for the caller to do once the lock is released. An
+        # entry being written keeps its array, so reads are served from
+        # memory until the file is complete.
+        spills = []
+        removals = []
+        for handle, entry in list(self._entries.items()):
+            if self.memory_bytes <= self.max_bytes:
+                break
+            if entry['path'] is not None:
+                continue
+            if self.spill_dir:
+                entry['path'] = os.path.join(self.spill_dir, handle + '.npy')
+                self.memory_bytes -= entry['nbytes']
+                self.spill_bytes += entry['nbytes']
+                self.spills += 1
+                spills.append((handle, entry))
+            else:
+                del self._entries[handle]
+                self._forget(entry)
+                self.evictions += 1
+        for handle, entry in list(self._entries.items()):
+            if self.spill_bytes <= self.max_spill_bytes:
+                break
+            if entry['path'] is not None:
+                del self._entries[handle]
+                removals.append(self._forget(entry))
+                self.evictions += 1
+        return spills, removals
+
+    def _write_spills(self, spills):
+        for handle, entry in spills:
+            try:
+                np.save(entry['path'], entry['array'], allow_pickle=False)
+            except OSError:
+                # Can't spill (disk full, say): drop it, as without a spill dir
+                with self._lock:
+                    if self._entries.get(handle) is entry:
+                        del self._entries[handle]
+                        self._forget(entry)
+                        self.evictions += 1
+                _remove_files([entry['path']])
+                continue
+            with self._lock:
+                stored = self._entries.get(handle) is entry
+                if stored:
+                    entry['array'] = None
+            if not stored:
+                # Deleted or evicted while being written
+                _remove_files([entry['path']])
+
+def _remove_files(paths):
+    for path in paths:
+        if path is None:
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+matrix_store = MatrixStore(MATRIX_STORE_BYTES, MATRIX_SPILL_DIR, MATRIX_SPILL_BYTES)
+
+@metrics.register_collector
+def _matrix_store_metrics():
+    stats = matrix_store.stats()
+    return [
+        ('matrix_store_size', 'gauge', 'Matrices held by handle.', stats['size']),
+        ('matrix_store_memory_bytes', 'gauge', 'Bytes of stored matrices held in memory.', stats['memory_bytes']),
+        ('matrix_store_spill_bytes', 'gauge', 'Bytes of stored matrices spilled to disk.', stats['spill_bytes']),
+        ('matrix_store_spills_total', 'counter', 'Matrices spilled from memory to disk.', stats['spills']),
+        ('matrix_store_evictions_total', 'counter', 'Matrices dropped from the store.', stats['evictions'])
+    ]
+
+def store_result(result):
+    # Handle for an array result, or {factor: handle} for a decomposition
+    if isinstance(result, dict):
+        return {name: matrix_store.put(value) for name, value in result.items()}
+    return matrix_store.put(np.asarray(result))
+
+def _step_operand(value, results, names):
+    # {'ref': name or index} reuses an earlier step's result in place;
+    # 'name.U' picks one factor of a decomposition
+    if not (isinstance(value, dict) and 'ref' in value):
+        return matrix_store.resolve(value)
+    ref = value['ref']
+    if isinstance(ref, int):
+        if not 0 <= ref < len(results):
+            raise MatrixError(f'Unknown step reference: {ref}')
+        return results[ref]
+    name, _, part = str(ref).partition('.')
+    if name not in names:
+        raise MatrixError(f'Unknown step reference: {ref}')
+    result = results[names[name]]
+    if part:
+        if not isinstance(result, dict) or part not in result:
+            raise MatrixError(f'Unknown step reference: {ref}')
+        return result[part]
+    if isinstance(result, dict):
+        raise MatrixError(f"Step '{name}' is a decomposition; reference one of its factors.")
+    return np.asarray(result)
+
+def run_pipeline(steps, check_condition=None):
+    # Runs [{'op', 'A', 'B', 'name', 'store'}, ...] in order. Intermediate
+    # results stay in memory for later steps; steps with 'store' also keep
+    # theirs as handles. Returns (last result, info) where info merges the
+    # steps' warnings and maps stored steps to their handles.
+    if not steps:
+        raise MatrixError('Pipeline has no steps.')
+    if len(steps) > MAX_PIPELINE_STEPS:
+        raise MatrixError(f'Pipeline has more than {MAX_PIPELINE_STEPS} steps.')
+    empty = decode_operand(None)
+    results = []
+    names = {}
+    info = {'warnings': [], 'handles': {}}
+    for i, step in enumerate(steps):
+        A = _step_operand(step['A'], results, names) if 'A' in step else empty
+        B = _step_operand(step['B'], results, names) if 'B' in step else empty
+        result, step_info = run_operation(step.get('op'), A, B, check_condition)
+        name = str(step.get('name', i))
+        names[name] = i
+        results.append(result)
+        info['warnings'].extend(f'step {name}: {w}' for w in step_info['warnings'])
+        if 'condition' in step_info:
+            info.setdefault('conditions', {})[name] = step_info['condition']
+        if step.get('store'):
+            info['handles'][name] = store_result(result)
+    return results[-1], info
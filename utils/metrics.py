@@ -0,0 +1,183 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+__all__ = [
+    'Counter', 'Histogram', 'counter', 'histogram', 'register_collector',
+    'stage', 'observe_stage', 'record_error', 'begin_request', 'end_request', 'render'
+]
+
+PREFIX = 'dsa_calc_'
+# Requests slower than this are logged as one JSON line (0 disables)
+SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', 1000))
+# Fraction of requests run under cProfile (0 disables)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+
+DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+
+slow_log = logging.getLogger('dsa_calc.slow_requests')
+profile_log = logging.getLogger('dsa_calc.profile')
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    parts = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {PREFIX}{self.name} {self.help}', f'# TYPE {PREFIX}{self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{PREFIX}{self.name}{_label_text(key)} {value}')
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        name = PREFIX + self.name
+        lines = [f'# HELP {name} {self.help}', f'# TYPE {name} histogram']
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append(f'{name}_bucket{_label_text(key + (("le", repr(float(bound))),))} {cumulative}')
+                lines.append(f'{name}_bucket{_label_text(key + (("le", "+Inf"),))} {count}')
+                lines.append(f'{name}_sum{_label_text(key)} {total}')
+                lines.append(f'{name}_count{_label_text(key)} {count}')
+        return lines
+
+_metrics = []
+_collectors = []
+
+def counter(name, help_text):
+    metric = Counter(name, help_text)
+    _metrics.append(metric)
+    return metric
+
+def histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    metric = Histogram(name, help_text, buckets)
+    _metrics.append(metric)
+    return metric
+
+def register_collector(func):
+    # func() returns (name, type, help, value) tuples read at scrape time,
+    # e.g. cache statistics kept elsewhere
+    _collectors.append(func)
+    return func
+
+requests_total = counter('requests_total', 'HTTP requests by route, method and status.')
+errors_total = counter('errors_total', 'Errors by route and exception type.')
+request_seconds = histogram('request_seconds', 'HTTP request latency in seconds.')
+stage_seconds = histogram('stage_seconds', 'Time spent in each processing stage, in seconds.')
+
+# Per-request stage timings, for the slow request log
+_current = threading.local()
+
+def observe_stage(name, elapsed):
+    # Record a stage duration measured elsewhere (e.g. in a worker process)
+    stage_seconds.observe(elapsed, stage=name)
+    timings = getattr(_current, 'stages', None)
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + elapsed
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+def record_error(error, route=None):
+    errors_total.inc(route=route or getattr(_current, 'route', ''), type=type(error).__name__)
+
+def begin_request(route):
+    _current.route = route
+    _current.stages = {}
+    _current.start = time.perf_counter()
+    _current.profiler = None
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        _current.profiler = cProfile.Profile()
+        _current.profiler.enable()
+
+def end_request(method, status):
+    start = getattr(_current, 'start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    route = _current.route
+    requests_total.inc(route=route, method=method, status=status)
+    request_seconds.observe(elapsed, route=route)
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        slow_log.warning(json.dumps({
+            'event': 'slow_request',
+            'route': route,
+            'method': method,
+            'status': status,
+            'duration_ms': round(elapsed * 1000, 3),
+            'stages_ms': {k: round(v * 1000, 3) for k, v in _current.stages.items()}
+        }))
+    profiler = _current.profiler
+    if profiler is not None:
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(25)
+        profile_log.info('profile for %s %s (%.1f ms)\n%s', method, route, elapsed * 1000, out.getvalue())
+    _current.start = None
+    _current.stages = None
+    _current.profiler = None
+
+def render():
+    # Prometheus text exposition format
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        for name, kind, help_text, value in collect():
+            lines.append(f'# HELP {PREFIX}{name} {help_text}')
+            lines.append(f'# TYPE {PREFIX}{name} {kind}')
+            lines.append(f'{PREFIX}{name} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,280 @@
+import decimal
+import os
+import threading
+from contextlib import contextmanager, nullcontext
+from fractions import Fraction
+
+import utils.evaluator as evaluator
+
+try:
+    import mpmath
+except ImportError:  # installed with sympy; only needed for the mpmath backend and decimal trig
+    mpmath = None
+
+__all__ = ['BACKENDS', 'DEFAULT_PRECISION', 'MAX_PRECISION', 'run_backend', 'format_result', 'to_native']
+
+# Numeric backends for the postfix evaluator. 'float' is the plain
+# evaluator.OPCODES path; the others re-read literals from their token text
+# (so 0.1 is exactly 1/10) and swap in their own opcode table.
+
+# Significant digits for decimal and mpmath when the request doesn't say
+DEFAULT_PRECISION = 50
+MAX_PRECISION = int(os.environ.get('MAX_PRECISION', 1000))
+# Largest exact power evaluated, in bits of the result
+MAX_EXACT_BITS = 1000000
+
+def _table(overrides):
+    # Same arities and step formats as the float table, with other functions
+    return {op: (arity, overrides.get(op, func), fmt) for op, (arity, func, fmt) in evaluator.OPCODES.items()}
+
+def _identity(a):
+    return a
+
+def _unsupported(name, mode):
+    def func(*args):
+        raise ValueError(f'{name} has no exact result in {mode} mode')
+    return func
+
+# Exact rationals
+
+def _iroot(n, k):
+    # Exact integer k-th root of n >= 0, or None
+    if n < 2:
+        return n
+    if k >= n.bit_length():
+        # 2^k > n, so the root is strictly between 1 and 2
+        return None
+    x = 1 << -(-n.bit_length() // k)
+    while True:
+        y = ((k - 1) * x + n // x ** (k - 1)) // k
+        if y >= x:
+            break
+        x = y
+    return x if x ** k == n else None
+
+def _root_name(k):
+    if k == 2:
+        return 'Square root'
+    if k == 3:
+        return 'Cube root'
+    suffix = 'th' if k % 100 in (11, 12, 13) else {1: 'st', 2: 'nd', 3: 'rd'}.get(k % 10, 'th')
+    return f'{k}{suffix} root'
+
+def _fraction_root(a, k):
+    if a < 0 and k % 2 == 0:
+        raise ValueError('Complex results are not supported in fraction mode')
+    num = _iroot(abs(a.numerator), k)
+    den = _iroot(a.denominator, k)
+    if num is None or den is None:
+        raise ValueError(f'{_root_name(k)} of {a} is not rational')
+    return Fraction(-num if a < 0 else num, den)
+
+def _fraction_pow(a, b):
+    if a == 0 and b < 0:
+        raise ValueError('Division by zero')
+    size = max(a.numerator.bit_length(), a.denominator.bit_length())
+    if b.denominator != 1 and b.denominator >= size:
+        # Only 0, 1 and -1 have roots this deep, and _iroot answers at once;
+        # the result is one of them too
+        return _fraction_root(a, b.denominator) ** b.numerator
+    # The root index counts against the same budget, since Newton steps in
+    # _iroot raise to the (index - 1)th power
+    if max(abs(b.numerator), b.denominator) * size > MAX_EXACT_BITS:
+        raise ValueError('Result is too large for exact evaluation')
+    if b.denominator != 1:
+        a = _fraction_root(a, b.denominator)
+    return a ** b.numerator
+
+class FractionBackend:
+    name = 'fraction'
+    opcodes = _table(dict(
+        {op: _unsupported(op, 'fraction') for op in ('sin', 'cos', 'tan', 'log', 'log10', 'exp', 'asin', 'acos', 'atan')},
+        **{'^': _fraction_pow, '**': _fraction_pow, 'sqrt': lambda a: _fraction_root(a, 2), 'conj': _identity}
+    ))
+
+    def context(self, precision):
+        return nullcontext()
+
+    def number(self, opcode, token):
+        if opcode == 'num':
+            return Fraction(token)
+        if opcode == 'imag':
+            raise ValueError('Complex numbers are not supported in fraction mode')
+        raise ValueError(f"Constant '{token}' is irrational; use decimal or mpmath mode")
+
+    def value(self, value):
+        if isinstance(value, complex):
+            raise ValueError('Complex numbers are not supported in fraction mode')
+        return Fraction(repr(value)) if isinstance(value, float) else Fraction(value)
+
+    def format(self, value, precision):
+        return str(value)
+
+# Decimal at a chosen precision
+
+_local = threading.local()
+
+def _mp():
+    # Per-thread mpmath context, so requests at different precisions don't race
+    ctx = getattr(_local, 'mp', None)
+    if ctx is None:
+        if mpmath is None:
+            raise ValueError('This mode requires mpmath')
+        ctx = _local.mp = mpmath.MPContext()
+    return ctx
+
+def _decimal_pow(a, b):
+    if a == 0 and b < 0:
+        raise ValueError('Division by zero')
+    if a < 0 and b != b.to_integral_value():
+        raise ValueError('Complex results are not supported in decimal mode')
+    return a ** b
+
+def _decimal_sqrt(a):
+    if a < 0:
+        raise ValueError('Complex results are not supported in decimal mode')
+    return a.sqrt()
+
+def _decimal_log(method):
+    def func(a):
+        if a <= 0:
+            raise ValueError('Logarithm domain error')
+        return getattr(a, method)()
+    return func
+
+def _decimal_trig(name):
+    # decimal has no trigonometry; compute it with mpmath at the same precision
+    def func(a):
+        ctx = _mp()
+        ctx.dps = decimal.getcontext().prec + 5
+        res = getattr(ctx, name)(ctx.mpf(str(a)))
+        if isinstance(res, ctx.mpc):
+            raise ValueError('math domain error')
+        return +decimal.Decimal(ctx.nstr(res, decimal.getcontext().prec + 2, strip_zeros=False))
+    return func
+
+class DecimalBackend:
+    name = 'decimal'
+    opcodes = _table(dict(
+        {name: _decimal_trig(name) for name in ('sin', 'cos', 'tan', 'asin', 'acos', 'atan')},
+        **{
+            '^': _decimal_pow, '**': _decimal_pow, 'sqrt': _decimal_sqrt, 'exp': lambda a: a.exp(),
+            'log': _decimal_log('ln'), 'log10': _decimal_log('log10'), 'conj': _identity
+        }
+    ))
+
+    def context(self, precision):
+        return decimal.localcontext(decimal.Context(prec=precision))
+
+    def number(self, opcode, token):
+        if opcode == 'num':
+            return decimal.Decimal(token)
+        if opcode == 'imag':
+            raise ValueError('Complex numbers are not supported in decimal mode')
+        if token == 'e':
+            return decimal.Decimal(1).exp()
+        ctx = _mp()
+        ctx.dps = decimal.getcontext().prec + 5
+        return +decimal.Decimal(ctx.nstr(+ctx.pi, decimal.getcontext().prec + 2, strip_zeros=False))
+
+    def value(self, value):
+        if isinstance(value, complex):
+            raise ValueError('Complex numbers are not supported in decimal mode')
+        return decimal.Decimal(repr(value)) if isinstance(value, float) else decimal.Decimal(value)
+
+    def format(self, value, precision):
+        return str(value)
+
+# mpmath at a chosen precision, complex results included
+
+def _mp_func(name):
+    def func(*args):
+        return getattr(_mp(), name)(*args)
+    return func
+
+def _mp_log(name):
+    def func(a):
+        if not isinstance(a, _mp().mpc) and a <= 0:
+            raise ValueError('Logarithm domain error')
+        return getattr(_mp(), name)(a)
+    return func
+
+class MpmathBackend:
+    name = 'mpmath'
+    opcodes = _table(dict(
+        {name: _mp_func(name) for name in ('sin', 'cos', 'tan', 'sqrt', 'exp', 'asin', 'acos', 'atan', 'conj')},
+        **{'^': _mp_func('power'), '**': _mp_func('power'), 'log': _mp_log('log'), 'log10': _mp_log('log10')}
+    ))
+
+    @contextmanager
+    def context(self, precision):
+        ctx = _mp()
+        saved = ctx.dps
+        ctx.dps = precision
+        try:
+            yield
+        finally:
+            ctx.dps = saved
+
+    def number(self, opcode, token):
+        ctx = _mp()
+        if opcode == 'num':
+            return ctx.mpf(token)
+        if opcode == 'imag':
+            coef = token[:-1]
+            return ctx.mpc(0, -1 if coef == '-' else 1 if coef in ('', '+') else ctx.mpf(coef))
+        return +ctx.pi if token == 'pi' else +ctx.e
+
+    def value(self, value):
+        ctx = _mp()
+        if isinstance(value, complex):
+            return ctx.mpc(value)
+        return ctx.mpf(repr(value)) if isinstance(value, float) else ctx.mpf(value)
+
+    def format(self, value, precision):
+        # str() would use whatever precision the thread's context has now
+        return _mp().nstr(value, precision)
+
+BACKENDS = {backend.name: backend for backend in (FractionBackend(), DecimalBackend(), MpmathBackend())}
+
+def run_backend(program, backend, precision=DEFAULT_PRECISION, trace=False, scope=None):
+    # Evaluates an unoptimized program (constant folding happened in float)
+    # with another number type; returns (result, steps) like run_program.
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown numeric backend: {backend}')
+    spec = BACKENDS[backend]
+    precision = int(precision)
+    if not 1 <= precision <= MAX_PRECISION:
+        raise ValueError(f'Precision must be between 1 and {MAX_PRECISION} digits')
+    scope = scope or {}
+    with spec.context(precision):
+        prepared = []
+        bound = {}
+        for opcode, token, value in program:
+            if opcode == 'var':
+                if value in scope:
+                    bound[value] = spec.value(scope[value])
+            elif opcode in ('num', 'imag', 'const'):
+                value = spec.number(opcode, token)
+            prepared.append((opcode, token, value))
+        try:
+            result, _, steps = evaluator.run_program(prepared, trace=trace, scope=bound, opcodes=spec.opcodes)
+        except (decimal.DivisionByZero, ZeroDivisionError):
+            raise ValueError('Division by zero')
+        except (decimal.Overflow, OverflowError):
+            raise ValueError('Result is out of range')
+        except ArithmeticError:
+            raise ValueError('Invalid operation')
+    return result, steps
+
+def format_result(value, backend, precision=DEFAULT_PRECISION):
+    # Text form of a run_backend result, at the precision it was computed with
+    return BACKENDS[backend].format(value, int(precision))
+
+def to_native(value):
+    # float or complex approximation, for storing results as variables
+    if isinstance(value, (int, float, complex)):
+        return value
+    if getattr(value, 'imag', 0):
+        return complex(value)
+    return float(value)
@@ -0,0 +1,117 @@
+import math
+
+import utils.parser as parser
+from utils.evaluator import OPCODES
+from utils.parser import TreeNode
+
+__all__ = ['optimize_tree', 'optimize_postfix', 'tree_to_postfix']
+
+# Operators whose value depends only on their operands, so constant operands can be folded
+PURE_OPERATORS = parser.binary_operators | parser.unary_operators
+
+def _constant_value(node):
+    # Numeric value of a literal/constant leaf, or None for anything else
+    if node.left is not None or node.right is not None:
+        return None
+    kind = parser.token_kind(node.value)
+    if kind == 'number' or kind == 'imag':
+        return parser.parse_number(node.value)
+    if kind == 'const':
+        return parser.constants[node.value]
+    return None
+
+def _literal(value):
+    # Token for a folded value, or None if it has no literal form
+    if isinstance(value, complex):
+        # An imaginary literal always has real part +0.0, so -(i) = -0-1j
+        # must stay unfolded to keep the sign of its zero
+        if value.real == 0 and math.copysign(1, value.real) > 0 and math.isfinite(value.imag):
+            return f'{value.imag!r}i'
+        return None
+    if isinstance(value, float) and math.isfinite(value):
+        return repr(value)
+    return None
+
+def _fold(token, operands):
+    values = [_constant_value(node) for node in operands]
+    if any(v is None for v in values):
+        return None
+    try:
+        res = OPCODES[token][1](*values)
+    except (ArithmeticError, ValueError, TypeError):
+        # Leave it for evaluation, which reports the error as usual
+        return None
+    literal = _literal(res)
+    return TreeNode(literal) if literal is not None else None
+
+def _is_number(node, number):
+    value = _constant_value(node)
+    return value is not None and parser.token_kind(node.value) == 'number' and value == number
+
+def _is_zero(node, sign):
+    # Literal zero with the given sign (1 or -1)
+    return _is_number(node, 0) and math.copysign(1, _constant_value(node)) == sign
+
+def _simplify(node):
+    # Safe algebraic identities: x*1, 1*x, x-(+0), x+(-0), (-0)+x, x/1, x^1,
+    # neg(neg(x)). The sign of the zero matters: -0.0 + 0 and -0.0 - -0 are
+    # both 0.0, not -0.0.
+    token, left, right = node.value, node.left, node.right
+    if token == '*':
+        if _is_number(right, 1):
+            return left
+        if _is_number(left, 1):
+            return right
+    elif token == '+':
+        if _is_zero(right, -1):
+            return left
+        if _is_zero(left, -1):
+            return right
+    elif token == '-':
+        if _is_zero(right, 1):
+            return left
+    elif token == '/' or token == '^' or token == '**':
+        if _is_number(right, 1):
+            return left
+    elif token == 'neg' and left.value == 'neg' and left.right is None:
+        return left.left
+    return node
+
+def optimize_tree(postfix):
+    # Builds the expression tree bottom-up, folding constant subtrees and
+    # applying the identities above as each node is created.
+    stack = []
+    for token in postfix:
+        kind = parser.token_kind(token)
+        if kind in ('number', 'imag', 'const', 'var'):
+            stack.append(TreeNode(token))
+            continue
+        if kind == 'binary':
+            right = stack.pop()
+            operands = [stack.pop(), right]
+        elif kind == 'unary':
+            operands = [stack.pop()]
+        else:
+            raise ValueError(f'Unknown token in tree: {token}')
+        folded = _fold(token, operands) if token in PURE_OPERATORS else None
+        stack.append(folded or _simplify(TreeNode(token, *operands)))
+    if len(stack) != 1:
+        raise ValueError('Invalid expression for tree')
+    return stack[0]
+
+def tree_to_postfix(root):
+    # Iterative post-order walk, so deep trees don't hit the recursion limit
+    postfix = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        postfix.append(node.value)
+        if node.left is not None:
+            stack.append(node.left)
+        if node.right is not None:
+            stack.append(node.right)
+    postfix.reverse()
+    return postfix
+
+def optimize_postfix(postfix):
+    return tree_to_postfix(optimize_tree(postfix))
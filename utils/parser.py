@@ -1,3 +1,4 @@
+import math
 import re
 
 # Operator precedence and associativity
@@ -11,77 +12,79 @@ precedence = {
 }
 right_associative = {'^', '**', 'neg'}
 
+binary_operators = {'+', '-', '*', '/', '^', '**'}
+unary_operators = {
+    'sin', 'cos', 'tan', 'log', 'log10', 'sqrt', 'exp', 'abs',
+    'asin', 'acos', 'atan', 'mod', 'conj', 'neg'
+}
+constants = {'pi': math.pi, 'e': math.e}
+
+# Token kinds for fixed tokens; literals and variables are classified in token_kind
+token_kinds = {'(': 'lparen', ')': 'rparen', '=': 'assign'}
+token_kinds.update({op: 'binary' for op in binary_operators})
+token_kinds.update({op: 'unary' for op in unary_operators})
+token_kinds.update({name: 'const' for name in constants})
+
+def token_kind(token):
+    # One of: number, imag, const, var, binary, unary, lparen, rparen, assign
+    kind = token_kinds.get(token)
+    if kind is not None:
+        return kind
+    last = token[-1:]
+    if last == 'i':
+        return 'imag'
+    if last.isdigit() or last == '.':
+        return 'number'
+    if len(token) == 1 and token.isalpha():
+        return 'var'
+    raise ValueError(f'Unknown token: {token}')
+
+def parse_number(token):
+    # Numeric payload for 'number' and 'imag' tokens ('2', '-3.5', '2i', '-1i')
+    if token.endswith('i'):
+        val = token[:-1]
+        if val == '' or val == '+':
+            return complex(0, 1)
+        elif val == '-':
+            return complex(0, -1)
+        return complex(0, float(val))
+    return float(token)
+
 # Tokenizer: splits input into numbers, operators, parentheses, functions, constants, variables, assignment
-# Improved: negative numbers as single token if after '(' or at start
+# Negative numbers are a single token if after an operator, '(' or at start.
+# One precompiled scanner; alternatives are tried in order at each position,
+# so earlier groups win (e.g. log10 before log, exp before e).
+_scanner = re.compile(r"""
+    (?P<assign>(?<![=<>!])=)
+  | (?P<negnum>(?<![^(*^/+\-])-[\d.]+i?)
+  | (?P<number>(?:\d|\.(?=\d))[\d.]*i?)
+  | (?P<imag>i)
+  | (?P<func>log10|sin|cos|tan|log|exp|abs|sqrt|asin|acos|atan)
+  | (?P<neg>(?<![^(*^/+\-])-)
+  | (?P<op>[-+*/^()])
+  | (?P<const>pi|e)
+  | (?P<var>[a-zA-Z])
+""", re.VERBOSE)
 
 def tokenize(expr):
     expr = expr.replace(' ', '')
     expr = expr.replace('**', '^')  # treat ** as ^ for now
     tokens = []
+    match = _scanner.match
     i = 0
-    while i < len(expr):
-        # Assignment
-        if expr[i] == '=' and (i == 0 or expr[i-1] not in '=<>!'):
-            tokens.append('=')
-            i += 1
-        # Complex number literal (e.g., 2i, -3.5i)
-        elif (expr[i] == '-' and (
-            (i == 0) or (expr[i-1] in '(*^/+-')
-        ) and (i+1 < len(expr) and (expr[i+1].isdigit() or expr[i+1] == '.'))):
-            num = '-'
-            i += 1
-            while i < len(expr) and (expr[i].isdigit() or expr[i] == '.'):
-                num += expr[i]
-                i += 1
-            # Check for 'i' after number
-            if i < len(expr) and expr[i] == 'i':
-                num += 'i'
-                i += 1
-            tokens.append(num)
-        elif expr[i].isdigit() or (expr[i] == '.' and i+1 < len(expr) and expr[i+1].isdigit()):
-            num = expr[i]
-            i += 1
-            while i < len(expr) and (expr[i].isdigit() or expr[i] == '.'):
-                num += expr[i]
-                i += 1
-            # Check for 'i' after number
-            if i < len(expr) and expr[i] == 'i':
-                num += 'i'
-                i += 1
-            tokens.append(num)
-        elif expr[i] == 'i':
+    n = len(expr)
+    while i < n:
+        m = match(expr, i)
+        if m is None:
+            raise ValueError(f'Unknown token: {expr[i:]}')
+        kind = m.lastgroup
+        if kind == 'imag':
             tokens.append('1i')
-            i += 1
-        elif expr[i:i+5] == 'log10':
-            tokens.append('log10')
-            i += 5
-        elif expr[i:i+3] in {'sin', 'cos', 'tan', 'log', 'exp', 'abs'}:
-            tokens.append(expr[i:i+3])
-            i += 3
-        elif expr[i:i+4] in {'sqrt', 'asin', 'acos', 'atan'}:
-            tokens.append(expr[i:i+4])
-            i += 4
-        elif expr[i] in '+-*/^()':
-            # True unary minus (not negative literal)
-            if expr[i] == '-' and (i == 0 or expr[i-1] in '(*^/+-'):
-                tokens.append('neg')
-            else:
-                tokens.append(expr[i])
-            i += 1
-        elif expr[i:i+2] == '**':
-            tokens.append('**')
-            i += 2
-        elif expr[i:i+2] == 'pi':
-            tokens.append('pi')
-            i += 2
-        elif expr[i] == 'e':
-            tokens.append('e')
-            i += 1
-        elif re.match(r'[a-zA-Z]', expr[i]):  # variable support
-            tokens.append(expr[i])
-            i += 1
+        elif kind == 'neg':
+            tokens.append('neg')
         else:
-            raise ValueError(f'Unknown token: {expr[i:]}')
+            tokens.append(m.group())
+        i = m.end()
     return tokens
 
 # Infix to Postfix conversion (Shunting Yard Algorithm)
@@ -102,17 +105,21 @@ def _infix_to_postfix(tokens):
     output = []
     stack = []
     for token in tokens:
-        if re.match(r'\d+\.\d+|\d+', token) or re.match(r'[a-zA-Z]', token):
+        kind = token_kind(token)
+        if kind in ('number', 'imag', 'const', 'var'):
             output.append(token)
-        elif token in precedence:
+        elif kind == 'unary':
+            # Prefix operators have no left operand, so nothing is popped
+            stack.append(token)
+        elif kind == 'binary':
             while (stack and stack[-1] != '(' and
                    ((precedence.get(stack[-1], 0) > precedence[token]) or
                     (precedence.get(stack[-1], 0) == precedence[token] and token not in right_associative))):
                 output.append(stack.pop())
             stack.append(token)
-        elif token == '(': 
+        elif kind == 'lparen':
             stack.append(token)
-        elif token == ')':
+        elif kind == 'rparen':
             found_paren = False
             while stack:
                 top = stack.pop()
@@ -130,36 +137,112 @@ def _infix_to_postfix(tokens):
         output.append(stack.pop())
     return output
 
+# Compile postfix tokens into (opcode, token, payload) instructions.
+# Opcodes are 'num', 'imag', 'const' and 'var' for operands (payload is the
+# parsed value, or the variable name) and the operator token itself otherwise.
+def compile_postfix(postfix):
+    program = []
+    for token in postfix:
+        kind = token_kind(token)
+        if kind == 'number':
+            program.append(('num', token, parse_number(token)))
+        elif kind == 'imag':
+            program.append(('imag', token, parse_number(token)))
+        elif kind == 'const':
+            program.append(('const', token, constants[token]))
+        elif kind == 'var':
+            program.append(('var', token, token))
+        elif kind == 'binary' or kind == 'unary':
+            program.append((token, token, None))
+        else:
+            raise ValueError(f'Unknown token in evaluation: {token}')
+    return program
+
 # TreeNode class for expression tree
 class TreeNode:
+    __slots__ = ('value', 'left', 'right')
+
     def __init__(self, value, left=None, right=None):
         self.value = value
         self.left = left
         self.right = right
 
     def to_dict(self):
-        node = {'value': self.value}
-        if self.left:
-            node['left'] = self.left.to_dict()
-        if self.right:
-            node['right'] = self.right.to_dict()
-        return node
-
-# Build expression tree from postfix tokens
-def build_expression_tree(postfix):
+        # Nested {'value', 'left', 'right'} dicts, built without recursion
+        root = {'value': self.value}
+        stack = [(self, root)]
+        while stack:
+            node, out = stack.pop()
+            if node.left:
+                child = {'value': node.left.value}
+                out['left'] = child
+                stack.append((node.left, child))
+            if node.right:
+                child = {'value': node.right.value}
+                out['right'] = child
+                stack.append((node.right, child))
+        return root
+
+    def to_arrays(self):
+        # Flat pre-order form: parallel lists of values and child indices
+        # (-1 for no child), root at index 0. Serializes at any depth.
+        values = []
+        left = []
+        right = []
+        stack = [(self, -1, None)]
+        while stack:
+            node, parent, side = stack.pop()
+            idx = len(values)
+            values.append(node.value)
+            left.append(-1)
+            right.append(-1)
+            if side is not None:
+                side[parent] = idx
+            if node.right:
+                stack.append((node.right, idx, right))
+            if node.left:
+                stack.append((node.left, idx, left))
+        return {'values': values, 'left': left, 'right': right}
+
+def tree_depth(root):
+    depth = 0
+    stack = [(root, 1)]
+    while stack:
+        node, d = stack.pop()
+        if d > depth:
+            depth = d
+        if node.left:
+            stack.append((node.left, d + 1))
+        if node.right:
+            stack.append((node.right, d + 1))
+    return depth
+
+# Trees nested deeper than this are returned in the flat to_arrays() form,
+# since nested dicts that deep can't be JSON-encoded within the recursion limit.
+TREE_NEST_LIMIT = 300
+
+# Build expression tree (TreeNode root) from postfix tokens
+def build_tree(postfix):
     stack = []
     for token in postfix:
-        if re.match(r'\d+\.\d+|\d+', token) or re.match(r'[a-zA-Z]', token):
+        kind = token_kind(token)
+        if kind in ('number', 'imag', 'const', 'var'):
             stack.append(TreeNode(token))
-        elif token in {'+', '-', '*', '/', '^', '**'}:
+        elif kind == 'binary':
             right = stack.pop()
             left = stack.pop()
             stack.append(TreeNode(token, left, right))
-        elif token in {'sin', 'cos', 'tan', 'log', 'log10', 'sqrt', 'exp', 'abs', 'asin', 'acos', 'atan', 'neg'}:
+        elif kind == 'unary':
             child = stack.pop()
             stack.append(TreeNode(token, child))
         else:
             raise ValueError(f'Unknown token in tree: {token}')
     if len(stack) != 1:
         raise ValueError('Invalid expression for tree')
-    return stack[0].to_dict() 
\ No newline at end of file
+    return stack[0]
+
+def build_expression_tree(postfix):
+    root = build_tree(postfix)
+    if tree_depth(root) > TREE_NEST_LIMIT:
+        return root.to_arrays()
+    return root.to_dict() 
\ No newline at end of file
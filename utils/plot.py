@@ -0,0 +1,249 @@
+import math
+import os
+import threading
+
+import numpy as np
+
+import utils.metrics as metrics
+from utils.cache import LRUCache, compile_expression, normalize_expression
+from utils.vectorized import VECTOR_OPCODES, evaluate_program_vectorized
+
+__all__ = ['sample_plot', 'plot_cache', 'sample_cache']
+
+# Rounds of midpoint refinement; intervals stop splitting at span / (width * 2**MAX_DEPTH)
+MAX_DEPTH = 10
+# Initial samples per viewport pixel column, before refinement
+SAMPLES_PER_PIXEL = 4
+# Samples evaluated per viewport pixel column, at most
+MAX_SAMPLES_PER_PIXEL = 32
+# Samples kept per expression for reuse across viewports
+MAX_CACHED_SAMPLES = 200000
+
+# Finished polylines by (expression, viewport, bound variables)
+plot_cache = LRUCache(int(os.environ.get('PLOT_CACHE_SIZE', 512)))
+# Evaluated samples by (expression, variable, bound variables), shared by all viewports
+sample_cache = LRUCache(int(os.environ.get('PLOT_SAMPLE_CACHE_SIZE', 64)))
+
+@metrics.register_collector
+def _plot_cache_metrics():
+    stats = plot_cache.stats()
+    samples = sample_cache.stats()
+    return [
+        ('plot_cache_hits_total', 'counter', 'Plot viewport cache hits.', stats['hits']),
+        ('plot_cache_misses_total', 'counter', 'Plot viewport cache misses.', stats['misses']),
+        ('plot_sample_cache_size', 'gauge', 'Expressions with cached plot samples.', samples['size'])
+    ]
+
+# Plotting wants real y values and gaps, not errors: domain errors and
+# complex results become NaN instead of failing the whole sample array.
+PLOT_OPCODES = dict(VECTOR_OPCODES, **{
+    '/': (2, np.divide),
+    '^': (2, np.power),
+    '**': (2, np.power),
+    'exp': (1, np.exp),
+    'log': (1, np.log),
+    'log10': (1, np.log10),
+    'sqrt': (1, np.sqrt),
+    'asin': (1, np.arcsin),
+    'acos': (1, np.arccos),
+})
+
+class _Samples:
+    # Sorted x/y samples of one function. Sample positions come from a dyadic
+    # lattice, so panned and zoomed viewports hit the same x values exactly.
+    def __init__(self):
+        self.xs = np.empty(0)
+        self.ys = np.empty(0)
+        self.lock = threading.Lock()
+
+    def lookup(self, xq):
+        idx = np.searchsorted(self.xs, xq)
+        idx = np.minimum(idx, max(len(self.xs) - 1, 0))
+        found = (self.xs[idx] == xq) if len(self.xs) else np.zeros(len(xq), dtype=bool)
+        ys = np.full(len(xq), np.nan)
+        ys[found] = self.ys[idx[found]]
+        return ys, found
+
+    def add(self, xn, yn, x_min, x_max):
+        xs = np.concatenate([self.xs, xn])
+        ys = np.concatenate([self.ys, yn])
+        if len(xs) > MAX_CACHED_SAMPLES:
+            # Keep the viewport being drawn; drop what lies outside it
+            keep = (xs >= x_min) & (xs <= x_max)
+            xs, ys = xs[keep], ys[keep]
+        order = np.argsort(xs, kind='stable')
+        self.xs, self.ys = xs[order], ys[order]
+
+def _real(values):
+    values = np.asarray(values)
+    if not np.iscomplexobj(values):
+        return values.astype(float, copy=False)
+    real = values.real
+    return np.where(np.abs(values.imag) <= 1e-12 * np.maximum(1, np.abs(real)), real, np.nan)
+
+class _Function:
+    def __init__(self, program, variable, scope, samples):
+        self.program = program
+        self.variable = variable
+        self.scope = scope
+        self.samples = samples
+        self.evaluated = 0
+
+    def __call__(self, xq, x_min, x_max):
+        with self.samples.lock:
+            ys, found = self.samples.lookup(xq)
+        missing = ~found
+        if missing.any():
+            xm = xq[missing]
+            with np.errstate(all='ignore'):
+                ym = _real(evaluate_program_vectorized(self.program, {self.variable: xm}, self.scope, PLOT_OPCODES))
+            ys[missing] = ym
+            self.evaluated += len(xm)
+            with self.samples.lock:
+                self.samples.add(xm, ym, x_min, x_max)
+        return ys
+
+def _lattice(x_min, x_max, width):
+    # Multiples of the largest power of two no wider than 1/SAMPLES_PER_PIXEL of a pixel
+    step = 2.0 ** math.floor(math.log2((x_max - x_min) / (width * SAMPLES_PER_PIXEL)))
+    grid = np.arange(math.ceil(x_min / step), math.floor(x_max / step) + 1) * step
+    return np.unique(np.concatenate([[x_min], grid, [x_max]])), step
+
+def _y_range(ys):
+    finite = ys[np.isfinite(ys)]
+    if not len(finite):
+        return -1.0, 1.0
+    low, high = np.percentile(finite, [2, 98])
+    if high - low < 1e-12:
+        low, high = low - 1, high + 1
+    return float(low), float(high)
+
+def _refine(f, xs, ys, x_min, x_max, y_min, y_max, y_tol, min_dx, budget):
+    # Split intervals whose ends disagree on being defined, whose y step is
+    # more than y_tol, or whose neighbours show curvature above y_tol, until
+    # they are min_dx wide or the sample budget is spent. Intervals entirely
+    # above or below the viewport are left alone.
+    for _ in range(MAX_DEPTH):
+        ya, yb = ys[:-1], ys[1:]
+        fa, fb = np.isfinite(ya), np.isfinite(yb)
+        both = fa & fb
+        split = fa != fb
+        split |= both & (np.abs(yb - ya) > y_tol)
+        if len(ys) > 2:
+            with np.errstate(invalid='ignore'):
+                bend = np.abs(ys[:-2] - 2 * ys[1:-1] + ys[2:]) > y_tol
+            bend = np.concatenate([[False], bend]) | np.concatenate([bend, [False]])
+            split |= both & bend
+        offscreen = both & (((ya > y_max) & (yb > y_max)) | ((ya < y_min) & (yb < y_min)))
+        split &= ~offscreen & (np.diff(xs) > min_dx)
+        idx = np.flatnonzero(split)
+        if not len(idx):
+            break
+        if len(idx) > budget - len(xs):
+            idx = idx[:max(budget - len(xs), 0)]
+            if not len(idx):
+                break
+        xm = (xs[idx] + xs[idx + 1]) / 2
+        ym = f(xm, x_min, x_max)
+        xs = np.insert(xs, idx + 1, xm)
+        ys = np.insert(ys, idx + 1, ym)
+    return xs, ys
+
+def _breaks(f, xs, ys, x_min, x_max, y_span):
+    # A jump of more than a viewport height that refinement could not shrink
+    # is a discontinuity if the midpoint doesn't lie between its ends (tan at
+    # pi/2, 1/x at 0); a steep but continuous stretch passes the test.
+    ya, yb = ys[:-1], ys[1:]
+    suspect = np.flatnonzero(np.isfinite(ya) & np.isfinite(yb) & (np.abs(yb - ya) > y_span))
+    if not len(suspect):
+        return suspect
+    ym = f((xs[suspect] + xs[suspect + 1]) / 2, x_min, x_max)
+    low = np.minimum(ya[suspect], yb[suspect])
+    high = np.maximum(ya[suspect], yb[suspect])
+    return suspect[~((ym >= low) & (ym <= high))]
+
+def _downsample(xs, ys, x_min, x_max, width):
+    # Keep the first, last, lowest and highest sample of each pixel column
+    # (per continuous run), which draws the same as the full polyline. Runs of
+    # undefined samples collapse to one gap.
+    finite = np.isfinite(ys)
+    keep = finite.copy()
+    keep[0] = True
+    keep[1:] |= finite[:-1]
+    xs, ys, finite = xs[keep], ys[keep], finite[keep]
+    n = len(xs)
+    if n <= 4 * width:
+        return xs, ys
+    column = np.floor((xs - x_min) / (x_max - x_min) * width)
+    new_group = np.ones(n, dtype=bool)
+    new_group[1:] = (column[1:] != column[:-1]) | ~finite[1:] | ~finite[:-1]
+    group = np.cumsum(new_group)
+    starts = np.flatnonzero(new_group)
+    ends = np.concatenate([starts[1:], [n]]) - 1
+    order = np.lexsort((np.where(finite, ys, 0), group))
+    group_starts = np.searchsorted(group[order], group[starts])
+    lowest = order[group_starts]
+    highest = order[np.concatenate([group_starts[1:], [n]]) - 1]
+    keep = np.unique(np.concatenate([starts, ends, lowest, highest]))
+    return xs[keep], ys[keep]
+
+def _variables_key(program, variable, scope):
+    # Values of the other variables the expression reads, for cache keys
+    names = sorted({token for opcode, token, _ in program if opcode == 'var' and token != variable})
+    for name in names:
+        if name not in scope:
+            raise ValueError(f"Variable '{name}' not defined")
+    return tuple((name, repr(scope[name])) for name in names)
+
+def sample_plot(expr, x_min, x_max, width=500, height=300, y_min=None, y_max=None, variable='x', scope=None):
+    # Returns {'x': [...], 'y': [...], 'breaks': [...], 'samples', 'evaluated'}.
+    # y holds None where the function is undefined and at each break, so the
+    # polyline can be drawn as-is; breaks lists the x positions of discontinuities.
+    if not (math.isfinite(x_min) and math.isfinite(x_max)) or x_max <= x_min:
+        raise ValueError('x_max must be greater than x_min')
+    width = max(1, min(int(width), 4096))
+    height = max(1, min(int(height), 4096))
+    scope = scope or {}
+    text = normalize_expression(expr)
+    compiled = compile_expression(text)
+    if compiled['assign_var']:
+        raise ValueError('Assignments cannot be plotted')
+    program = compiled['optimized']
+    bound = _variables_key(program, variable, scope)
+    key = (text, variable, x_min, x_max, y_min, y_max, width, height, bound)
+    cached = plot_cache.get(key)
+    if cached is not None:
+        return dict(cached, evaluated=0)
+    samples = sample_cache.get((text, variable, bound))
+    if samples is None:
+        samples = _Samples()
+        sample_cache.put((text, variable, bound), samples)
+    f = _Function(compiled['dag'] or program, variable, scope, samples)
+
+    with metrics.stage('plot_sample'):
+        xs, step = _lattice(x_min, x_max, width)
+        ys = f(xs, x_min, x_max)
+        if y_min is None or y_max is None or y_max <= y_min:
+            y_min, y_max = _y_range(ys)
+        y_tol = (y_max - y_min) / height / 2
+        budget = width * MAX_SAMPLES_PER_PIXEL
+        xs, ys = _refine(f, xs, ys, x_min, x_max, y_min, y_max, y_tol, step / 2 ** MAX_DEPTH, budget)
+        breaks = _breaks(f, xs, ys, x_min, x_max, y_max - y_min)
+    with metrics.stage('plot_downsample'):
+        total = len(xs)
+        if len(breaks):
+            # A NaN point between the two sides of each break ends the line there
+            gap_x = (xs[breaks] + xs[breaks + 1]) / 2
+            xs = np.insert(xs, breaks + 1, gap_x)
+            ys = np.insert(ys, breaks + 1, np.nan)
+        xs, ys = _downsample(xs, ys, x_min, x_max, width)
+    response = {
+        'x': xs.tolist(),
+        'y': [y if math.isfinite(y) else None for y in ys.tolist()],
+        'breaks': gap_x.tolist() if len(breaks) else [],
+        'y_range': [y_min, y_max],
+        'samples': total,
+        'evaluated': f.evaluated
+    }
+    plot_cache.put(key, response)
+    return response
@@ -0,0 +1,157 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+__all__ = ['DEFAULT_SCOPE', 'MemoryBackend', 'SQLiteBackend', 'ScopeStore', 'scope_store']
+
+# Variables used by clients that don't send a session token. This scope is
+# never expired, so it behaves like the old process-global variables dict.
+DEFAULT_SCOPE = 'default'
+
+class MemoryBackend:
+    # Per-process storage. Each scope's dict is copied on write and never
+    # mutated once published, so snapshots can be handed out without copying.
+    def __init__(self):
+        self._scopes = {}
+        self._access = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self, scope_id):
+        with self._lock:
+            self._access[scope_id] = time.monotonic()
+            return self._scopes.get(scope_id, {})
+
+    def set(self, scope_id, name, value):
+        with self._lock:
+            scope = dict(self._scopes.get(scope_id, {}))
+            scope[name] = value
+            self._scopes[scope_id] = scope
+            self._access[scope_id] = time.monotonic()
+
+    def delete(self, scope_id, name):
+        with self._lock:
+            scope = self._scopes.get(scope_id, {})
+            if name not in scope:
+                return False
+            scope = dict(scope)
+            del scope[name]
+            self._scopes[scope_id] = scope
+            self._access[scope_id] = time.monotonic()
+            return True
+
+    def expire(self, ttl, keep=()):
+        cutoff = time.monotonic() - ttl
+        with self._lock:
+            stale = [s for s, t in self._access.items() if t < cutoff and s not in keep]
+            for scope_id in stale:
+                self._scopes.pop(scope_id, None)
+                del self._access[scope_id]
+            return len(stale)
+
+def _encode(value):
+    if isinstance(value, complex):
+        return json.dumps({'re': value.real, 'im': value.imag})
+    return json.dumps(value)
+
+def _decode(text):
+    value = json.loads(text)
+    if isinstance(value, dict):
+        return complex(value['re'], value['im'])
+    return value
+
+class SQLiteBackend:
+    # Shared storage for several worker processes on one host. Every
+    # snapshot reads the database, so all workers see the same bindings.
+    # Reads only write the scope's access time once it is touch_interval
+    # seconds old, so /calculate doesn't take the database's write lock.
+    def __init__(self, path, touch_interval=0):
+        self.path = path
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS variables ('
+                       'scope TEXT, name TEXT, value TEXT, PRIMARY KEY (scope, name))')
+            db.execute('CREATE TABLE IF NOT EXISTS scopes (scope TEXT PRIMARY KEY, accessed REAL)')
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10)
+            self._local.db = db
+        return db
+
+    def _touch(self, db, scope_id):
+        db.execute('INSERT OR REPLACE INTO scopes (scope, accessed) VALUES (?, ?)', (scope_id, time.time()))
+
+    def snapshot(self, scope_id):
+        db = self._connect()
+        accessed = db.execute('SELECT accessed FROM scopes WHERE scope = ?', (scope_id,)).fetchone()
+        rows = db.execute('SELECT name, value FROM variables WHERE scope = ?', (scope_id,)).fetchall()
+        if accessed is None or accessed[0] < time.time() - self.touch_interval:
+            with db:
+                self._touch(db, scope_id)
+        return {name: _decode(value) for name, value in rows}
+
+    def set(self, scope_id, name, value):
+        with self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO variables (scope, name, value) VALUES (?, ?, ?)',
+                       (scope_id, name, _encode(value)))
+            self._touch(db, scope_id)
+
+    def delete(self, scope_id, name):
+        with self._connect() as db:
+            deleted = db.execute('DELETE FROM variables WHERE scope = ? AND name = ?', (scope_id, name)).rowcount
+            self._touch(db, scope_id)
+        return deleted > 0
+
+    def expire(self, ttl, keep=()):
+        cutoff = time.time() - ttl
+        with self._connect() as db:
+            stale = [row[0] for row in db.execute('SELECT scope FROM scopes WHERE accessed < ?', (cutoff,))
+                     if row[0] not in keep]
+            for scope_id in stale:
+                db.execute('DELETE FROM variables WHERE scope = ?', (scope_id,))
+                db.execute('DELETE FROM scopes WHERE scope = ?', (scope_id,))
+        return len(stale)
+
+class ScopeStore:
+    # Variable bindings keyed by session token, with idle scopes evicted after ttl seconds
+    def __init__(self, backend=None, ttl=3600):
+        self.backend = backend or MemoryBackend()
+        self.ttl = ttl
+        self._next_sweep = time.monotonic() + ttl
+        self._sweep_lock = threading.Lock()
+
+    def _maybe_expire(self):
+        now = time.monotonic()
+        if now < self._next_sweep or not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_sweep = now + min(self.ttl, 60)
+            self.backend.expire(self.ttl, keep=(DEFAULT_SCOPE,))
+        finally:
+            self._sweep_lock.release()
+
+    def snapshot(self, scope_id=DEFAULT_SCOPE):
+        # Read-only view for evaluation; copy it before mutating
+        self._maybe_expire()
+        return self.backend.snapshot(scope_id)
+
+    def set(self, scope_id, name, value):
+        self._maybe_expire()
+        self.backend.set(scope_id, name, value)
+
+    def delete(self, scope_id, name):
+        return self.backend.delete(scope_id, name)
+
+def _default_store():
+    ttl = float(os.environ.get('VARIABLE_TTL', 3600))
+    path = os.environ.get('VARIABLE_DB')
+    # A scope read within the last tenth of the TTL isn't touched again, so
+    # it may expire up to that much early
+    return ScopeStore(SQLiteBackend(path, ttl / 10) if path else MemoryBackend(), ttl)
+
+scope_store = _default_store()
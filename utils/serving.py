@@ -0,0 +1,252 @@
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import utils.metrics as metrics
+
+__all__ = ['Lane', 'AsgiApp', 'ROUTE_LANES']
+
+# Async serving: runs the Flask (WSGI) app under an ASGI server. Cheap
+# routes run inline on the event loop; heavy ones are handed to bounded
+# lanes so they can't hold up the cheap ones.
+
+# Threads for NumPy-bound routes (NumPy releases the GIL in its kernels)
+THREAD_WORKERS = int(os.environ.get('ASYNC_THREAD_WORKERS', os.cpu_count() or 4))
+# Requests allowed to wait for a thread before new ones get 503
+THREAD_QUEUE = int(os.environ.get('ASYNC_THREAD_QUEUE', 64))
+# Concurrent /equation requests; each waits on the solver's process pool
+SOLVER_CONCURRENCY = int(os.environ.get('ASYNC_SOLVER_WORKERS', max(1, int(os.environ.get('SOLVER_WORKERS', 2)))))
+SOLVER_QUEUE = int(os.environ.get('ASYNC_SOLVER_QUEUE', 16))
+# Inline-route requests with bodies larger than this go to the thread lane,
+# since parse time grows with expression length
+INLINE_MAX_BYTES = int(os.environ.get('ASYNC_INLINE_MAX_BYTES', 16384))
+
+# Path prefix -> lane; anything else runs inline
+ROUTE_LANES = (
+    ('/equation', 'solver'),
+    ('/calculate/stream', 'threads'),
+    ('/matrix', 'threads'),
+    ('/complex_batch', 'threads'),
+    ('/evaluate_vectorized', 'threads'),
+    ('/plot', 'threads'),
+    ('/compile', 'threads'),  # also /compiled/<id>
+    ('/calculate_batch', 'threads'),
+)
+
+rejected = metrics.counter('async_rejected_total', 'Requests turned away with 503 because a lane queue was full.')
+
+class Busy(Exception):
+    pass
+
+def _slow_evaluation(body, query):
+    # Non-float backends (fraction, decimal, mpmath) or an explicit precision
+    # can run for seconds on a tiny request, so they don't qualify as cheap
+    if b'backend' not in body and b'precision' not in body and b'backend' not in query and b'precision' not in query:
+        return False
+    try:
+        data = json.loads(body) if body else {}
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    for name, value in urllib.parse.parse_qsl(query.decode('latin-1')):
+        data.setdefault(name, value)
+    return data.get('backend', 'float') != 'float' or data.get('precision') is not None
+
+class Lane:
+    # At most `workers` requests run at once, each on the lane's own thread
+    # pool, and at most `queue` more wait for a slot; beyond that requests
+    # are rejected rather than queued without bound.
+    def __init__(self, name, workers, queue):
+        self.name = name
+        self.workers = max(1, workers)
+        self.queue = queue
+        self.active = 0
+        self.waiting = 0
+        self._slots = None
+        self._executor = None
+
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f'asgi-{self.name}')
+        return self._executor
+
+    async def acquire(self):
+        # Takes a slot, waiting in the lane's queue; raises Busy when it is
+        # full. Only touched from the event loop thread, so the counters need
+        # no lock.
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        if self.active >= self.workers and self.waiting >= self.queue:
+            rejected.inc(lane=self.name)
+            raise Busy(self.name)
+        self.waiting += 1
+        start = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        metrics.observe_stage(f'queue_{self.name}', time.perf_counter() - start)
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self._slots.release()
+
+    async def call(self, func, *args):
+        # Runs func on the lane's threads; the caller holds a slot
+        return await asyncio.get_running_loop().run_in_executor(self.executor(), func, *args)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+def _environ(scope, body):
+    # PEP 3333 environ for an ASGI http scope
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+            continue
+        key = 'HTTP_' + name
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    # The body is fully buffered, so its length is known even for chunked or
+    # HTTP/2 requests that sent no Content-Length
+    environ['CONTENT_LENGTH'] = str(len(body))
+    environ['wsgi.input_terminated'] = True
+    return environ
+
+class AsgiApp:
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.lanes = {
+            'threads': Lane('threads', THREAD_WORKERS, THREAD_QUEUE),
+            'solver': Lane('solver', SOLVER_CONCURRENCY, SOLVER_QUEUE),
+        }
+        metrics.register_collector(self._lane_metrics)
+
+    def _lane_metrics(self):
+        rows = []
+        for name, lane in self.lanes.items():
+            rows.append((f'async_{name}_active', 'gauge', f'Requests running in the {name} lane.', lane.active))
+            rows.append((f'async_{name}_waiting', 'gauge', f'Requests waiting for the {name} lane.', lane.waiting))
+        return rows
+
+    def lane_for(self, path, body, query=b''):
+        for prefix, lane in ROUTE_LANES:
+            if path.startswith(prefix):
+                return self.lanes[lane]
+        if len(body) > INLINE_MAX_BYTES or _slow_evaluation(body, query):
+            return self.lanes['threads']
+        return None
+
+    def _start(self, environ):
+        # Calls the WSGI app and reads the first body chunk, so the handler
+        # itself runs in the caller's lane; returns (status, headers, first
+        # chunk, chunk iterator, the app's iterable to close)
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+            return lambda data: None
+
+        body = self.wsgi_app(environ, start_response)
+        iterator = iter(body)
+        first = next(iterator, None)
+        return started[0], started[1], first, iterator, body
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        body = b''.join(chunks)
+        environ = _environ(scope, body)
+        lane = self.lane_for(scope['path'], body, scope.get('query_string', b''))
+        # A lane slot is held until the response body is drained, since a
+        # streamed body may be a generator doing the real work
+        held = None
+        closable = None
+        try:
+            try:
+                if lane is None:
+                    status, headers, first, iterator, closable = self._start(environ)
+                    # Inline responses with a Content-Length are already
+                    # rendered; any other body is pulled in the thread lane
+                    if not any(k.lower() == 'content-length' for k, _ in headers):
+                        held = self.lanes['threads']
+                        await held.acquire()
+                else:
+                    await lane.acquire()
+                    held = lane
+                    status, headers, first, iterator, closable = await lane.call(self._start, environ)
+            except Busy as e:
+                payload = json.dumps({'error': f'Server busy ({e} queue full); retry shortly.'}).encode()
+                await send({'type': 'http.response.start', 'status': 503, 'headers': [
+                    (b'content-type', b'application/json'), (b'retry-after', b'1'),
+                    (b'content-length', str(len(payload)).encode())]})
+                await send({'type': 'http.response.body', 'body': payload})
+                return
+            await send({
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]
+            })
+            chunk = first
+            while chunk is not None:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                chunk = next(iterator, None) if held is None else await held.call(next, iterator, None)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(closable, 'close'):
+                closable.close()
+            if held is not None:
+                held.release()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                for lane in self.lanes.values():
+                    lane.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,198 @@
+import math
+import multiprocessing
+import os
+import re
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+from sympy import Eq, Poly, PolynomialError, solve, symbols, sympify
+
+import utils.metrics as metrics
+from utils.cache import LRUCache
+
+__all__ = ['insert_mult', 'canonical_key', 'solve_equation', 'solution_cache']
+
+# Seconds a symbolic solve may run before it is cancelled
+SOLVER_TIMEOUT = float(os.environ.get('SOLVER_TIMEOUT', 10))
+# Worker processes for symbolic solves; 0 solves inline with no time limit
+SOLVER_WORKERS = int(os.environ.get('SOLVER_WORKERS', 2))
+
+solution_cache = LRUCache(int(os.environ.get('EQUATION_CACHE_SIZE', 1024)))
+solve_timeouts = metrics.counter('equation_timeouts_total', 'Symbolic solves cancelled after SOLVER_TIMEOUT.')
+
+@metrics.register_collector
+def _solution_cache_metrics():
+    stats = solution_cache.stats()
+    return [
+        ('equation_cache_hits_total', 'counter', 'Equation solution cache hits.', stats['hits']),
+        ('equation_cache_misses_total', 'counter', 'Equation solution cache misses.', stats['misses'])
+    ]
+
+_pool = None
+_pool_lock = threading.Lock()
+_worker_pids = {}  # pool -> SimpleQueue of its workers' PIDs
+
+def insert_mult(expr):
+    # Insert * between number and variable (e.g., 2x -> 2*x)
+    return re.sub(r'(\d)([a-zA-Z])', r'\1*\2', expr)
+
+def _sides(eqn):
+    # Split equation at '='
+    if '=' in eqn:
+        left, right = eqn.split('=', 1)
+    else:
+        left, right = eqn, '0'
+    return insert_mult(left), insert_mult(right)
+
+def canonical_key(eqn, variable):
+    left, right = _sides(''.join(eqn.split()))
+    return f'{left}={right}', variable
+
+class _Deadline(BaseException):
+    # Raised in a worker by its alarm; a BaseException so sympy's own
+    # `except Exception` handlers don't swallow it
+    pass
+
+def _alarm(signum, frame):
+    raise _Deadline()
+
+def _polynomial(expr, var):
+    # Coefficients of expr as a polynomial in var when they are all finite
+    # numbers, else None
+    try:
+        poly = Poly(expr, var)
+        if len(poly.free_symbols) != 1 or not all(c.is_number for c in poly.all_coeffs()):
+            return None
+        coeffs = [complex(c) for c in poly.all_coeffs()]
+    except (PolynomialError, OverflowError, TypeError, ValueError):
+        return None
+    if not all(math.isfinite(c.real) and math.isfinite(c.imag) for c in coeffs):
+        return None
+    return coeffs
+
+def _solve_symbolic(eqn, variable, deadline=None):
+    # Runs in a worker process; returns (response, {stage: seconds}, timed
+    # out). With a deadline (time.time() seconds), an alarm stops the solve
+    # shortly before it, and polynomials fall back to numeric roots of the
+    # coefficients found while parsing. The caller's timeout still backs
+    # this up, since the alarm can't interrupt a long C-level operation.
+    timings = {}
+    timer = deadline is not None and hasattr(signal, 'setitimer')
+    if timer:
+        previous = signal.signal(signal.SIGALRM, _alarm)
+        signal.setitimer(signal.ITIMER_REAL, max(deadline - time.time() - _margin(), 0.001))
+    text = coeffs = None
+    try:
+        var = symbols(variable)
+        left, right = _sides(eqn)
+        start = time.perf_counter()
+        left_expr = sympify(left)
+        right_expr = sympify(right)
+        timings['sympify'] = time.perf_counter() - start
+        text = f"{left_expr} = {right_expr}"
+        if timer:
+            coeffs = _polynomial(left_expr - right_expr, var)
+        start = time.perf_counter()
+        sol = solve(Eq(left_expr, right_expr), var)
+        timings['solve'] = time.perf_counter() - start
+        steps = [f"Equation: {text}", f"Solve for {var}", f"Solution: {sol}"]
+        return {'result': str(sol), 'steps': steps}, timings, False
+    except _Deadline:
+        if coeffs is None:
+            return {'error': f'Solving timed out after {SOLVER_TIMEOUT:g} seconds.'}, timings, True
+        return _solve_numeric(text, coeffs), timings, True
+    except Exception as e:
+        return {'error': str(e)}, timings, False
+    finally:
+        if timer:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+def _margin():
+    # Time left between the worker's alarm and the caller's timeout, for the
+    # numeric fallback and the trip back
+    return min(0.5, SOLVER_TIMEOUT / 10)
+
+def _solve_numeric(text, coeffs):
+    # Fallback for polynomials: roots of the coefficient vector
+    roots = np.roots(coeffs)
+    sol = [float(r.real) if abs(r.imag) < 1e-12 else complex(r) for r in roots]
+    steps = [
+        f"Equation: {text}",
+        f"Symbolic solve timed out after {SOLVER_TIMEOUT:g}s; using numeric polynomial roots",
+        f"Solution: {sol}"
+    ]
+    return {'result': str(sol), 'steps': steps, 'method': 'numeric'}
+
+def _register_worker(pids):
+    # Pool initializer: reports the worker's PID so a stuck pool can be killed
+    pids.put(os.getpid())
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            pids = multiprocessing.SimpleQueue()
+            _pool = ProcessPoolExecutor(max_workers=SOLVER_WORKERS, initializer=_register_worker, initargs=(pids,))
+            _worker_pids[_pool] = pids
+        return _pool
+
+def _reset_pool(pool):
+    # A running task can't be cancelled, so stop its workers and start a
+    # fresh pool; other solves on the old pool fail with BrokenProcessPool
+    # and are retried once on the new one.
+    global _pool
+    with _pool_lock:
+        if _pool is not pool:
+            return
+        _pool = None
+        pids = _worker_pids.pop(pool)
+    while not pids.empty():
+        try:
+            os.kill(pids.get(), signal.SIGTERM)
+        except OSError:
+            pass
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _run_in_pool(func, args, deadline):
+    # Runs func(*args) in the pool until deadline (time.monotonic() seconds)
+    for attempt in range(2):
+        pool = _get_pool()
+        future = pool.submit(func, *args)
+        try:
+            return future.result(timeout=max(deadline - time.monotonic(), 0))
+        except FutureTimeout:
+            future.cancel()
+            _reset_pool(pool)
+            raise
+        except BrokenProcessPool:
+            _reset_pool(pool)
+            if attempt:
+                raise
+
+def solve_equation(eqn, variable):
+    # Returns the /equation response payload for eqn solved for variable
+    key = canonical_key(eqn, variable)
+    cached = solution_cache.get(key)
+    if cached is not None:
+        return cached
+    if SOLVER_WORKERS <= 0:
+        response, timings, timed_out = _solve_symbolic(eqn, variable)
+    else:
+        try:
+            response, timings, timed_out = _run_in_pool(
+                _solve_symbolic, (eqn, variable, time.time() + SOLVER_TIMEOUT), time.monotonic() + SOLVER_TIMEOUT)
+        except FutureTimeout:
+            solve_timeouts.inc()
+            return {'error': f'Solving timed out after {SOLVER_TIMEOUT:g} seconds.'}
+    for name, elapsed in timings.items():
+        metrics.observe_stage(name, elapsed)
+    if timed_out:
+        solve_timeouts.inc()
+        return response
+    solution_cache.put(key, response)
+    return response
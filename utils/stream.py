@@ -0,0 +1,57 @@
+import json
+import os
+
+import utils.dag as dag
+import utils.evaluator as evaluator
+import utils.metrics as metrics
+from utils.jsonutil import json_value
+
+__all__ = ['STREAM_MAX_STEPS', 'stream_calculation', 'encode_ndjson', 'encode_sse']
+
+# Most steps sent by one streamed request; clients page past it with offset
+STREAM_MAX_STEPS = int(os.environ.get('STREAM_MAX_STEPS', 100000))
+# Steps per 'steps' record
+CHUNK_STEPS = 256
+
+def stream_calculation(compiled, scope, offset=0, limit=None, chunk=CHUNK_STEPS):
+    # Records for a streamed /calculate: first {'type': 'result'} with the
+    # result and tree, then {'type': 'steps'} chunks of the trace starting at
+    # offset, then {'type': 'end'} with next_offset when the trace was cut
+    # at limit (or STREAM_MAX_STEPS). Only one chunk is held at a time.
+    program = compiled['program']
+    total = len(program)
+    try:
+        with metrics.stage('evaluate'):
+            result = dag.evaluate(compiled, scope)
+    except Exception as e:
+        metrics.record_error(e)
+        yield {'type': 'error', 'error': str(e)}
+        return
+    yield {
+        'type': 'result',
+        'result': json_value(result),
+        'tokens': compiled['tokens'],
+        'postfix': compiled['postfix'],
+        'tree': compiled['tree'],
+        'total_steps': total
+    }
+    offset = max(0, offset)
+    end = min(total, offset + (STREAM_MAX_STEPS if limit is None else min(limit, STREAM_MAX_STEPS)))
+    sent = offset
+    steps = []
+    if offset < end:
+        for step in evaluator.iter_steps(program, scope, start=offset):
+            steps.append(step)
+            if sent + len(steps) >= end or len(steps) >= chunk:
+                yield {'type': 'steps', 'offset': sent, 'steps': steps}
+                sent += len(steps)
+                steps = []
+                if sent >= end:
+                    break
+    yield {'type': 'end', 'sent': sent - offset, 'total_steps': total, 'next_offset': end if end < total else None}
+
+def encode_ndjson(record):
+    return json.dumps(record, separators=(',', ':')) + '\n'
+
+def encode_sse(record):
+    return f"event: {record['type']}\ndata: {json.dumps(record, separators=(',', ':'))}\n\n"
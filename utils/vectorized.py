@@ -0,0 +1,153 @@
+import operator
+
+import numpy as np
+
+import utils.evaluator as evaluator
+from utils.cache import compile_expression
+from utils.dag import ExpressionDag
+
+__all__ = ['evaluate_program_vectorized', 'evaluate_vectorized', 'to_json']
+
+# Same semantics as the scalar opcodes in utils/evaluator.py, over whole arrays:
+# domain errors raise if any element is out of range (with the scalar path's
+# exception types and messages), sqrt and fractional powers of negative reals
+# go complex instead of producing NaN. NumPy's own warnings are silenced.
+
+def _is_real(a):
+    return not np.iscomplexobj(a)
+
+def _divide(a, b):
+    if np.any(b == 0):
+        raise ValueError('Division by zero')
+    return np.divide(a, b)
+
+def _overflowed(res, *args):
+    # Infinite results from finite operands, which the scalar path raises on
+    finite = np.isfinite(args[0])
+    for a in args[1:]:
+        finite = finite & np.isfinite(a)
+    return np.any(np.isinf(res) & finite)
+
+def _power(a, b):
+    if _is_real(a) and _is_real(b):
+        if np.any((a == 0) & (b < 0)):
+            raise ZeroDivisionError('0.0 cannot be raised to a negative power')
+        if np.any((a < 0) & (b != np.floor(b))):
+            a = np.asarray(a, dtype=np.complex128)
+    elif np.any((a == 0) & ((np.real(b) < 0) | (np.imag(b) != 0))):
+        raise ZeroDivisionError('0.0 to a negative or complex power')
+    res = np.power(a, b)
+    if _overflowed(res, a, b):
+        raise OverflowError('Numerical result out of range')
+    return res
+
+def _exp(a):
+    res = np.exp(a)
+    if _overflowed(res, a):
+        raise OverflowError('math range error')
+    return res
+
+def _log(a):
+    if np.any(a <= 0):
+        raise ValueError('Logarithm domain error')
+    return np.log(a)
+
+def _log10(a):
+    if np.any(a <= 0):
+        raise ValueError('Logarithm domain error')
+    return np.log10(a)
+
+def _sqrt(a):
+    if _is_real(a) and np.any(a < 0):
+        return np.sqrt(np.asarray(a, dtype=np.complex128))
+    return np.sqrt(a)
+
+def _asin(a):
+    if np.any(np.abs(a) > 1):
+        raise ValueError('math domain error')
+    return np.arcsin(a)
+
+def _acos(a):
+    if np.any(np.abs(a) > 1):
+        raise ValueError('math domain error')
+    return np.arccos(a)
+
+# Opcode table: opcode -> (arity, ufunc-style callable)
+VECTOR_OPCODES = {
+    '+': (2, np.add),
+    '-': (2, np.subtract),
+    '*': (2, np.multiply),
+    '/': (2, _divide),
+    '^': (2, _power),
+    '**': (2, _power),
+    'sin': (1, np.sin),
+    'cos': (1, np.cos),
+    'tan': (1, np.tan),
+    'log': (1, _log),
+    'log10': (1, _log10),
+    'sqrt': (1, _sqrt),
+    'exp': (1, _exp),
+    'asin': (1, _asin),
+    'acos': (1, _acos),
+    'atan': (1, np.arctan),
+    'abs': (1, np.abs),
+    'mod': (1, np.abs),
+    'conj': (1, np.conj),
+    'neg': (1, operator.neg),
+}
+
+def evaluate_program_vectorized(program, bindings, scope=None, opcodes=VECTOR_OPCODES):
+    # bindings maps variable names to scalars or arrays; unbound variables
+    # fall back to scope (default: the values stored in evaluator.variables).
+    # opcodes swaps in another operator table, e.g. NaN-producing ones for plotting.
+    # program may also be an ExpressionDag, which evaluates repeated subterms once.
+    scope = dict(evaluator.variables if scope is None else scope)
+    for name, value in bindings.items():
+        scope[name] = np.asarray(value, dtype=np.complex128 if np.iscomplexobj(value) else np.float64)
+    with np.errstate(all='ignore'):
+        if isinstance(program, ExpressionDag):
+            result = program.evaluate(scope, opcodes)
+        else:
+            result = _run_stack(program, scope, opcodes)
+    shape = np.broadcast_shapes(*(np.shape(v) for v in scope.values() if isinstance(v, np.ndarray)))
+    return np.broadcast_to(result, shape)
+
+def _run_stack(program, scope, opcodes):
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    for opcode, token, value in program:
+        if opcode == 'var':
+            if token not in scope:
+                raise ValueError(f"Variable '{token}' not defined")
+            push(scope[token])
+        elif opcode in ('num', 'const', 'imag'):
+            push(value)
+        else:
+            arity, func = opcodes[opcode]
+            if arity == 1:
+                push(func(pop()))
+            else:
+                b = pop()
+                push(func(pop(), b))
+    if len(stack) != 1:
+        raise ValueError('Invalid expression for evaluation')
+    return stack[0]
+
+def evaluate_vectorized(expr, bindings, scope=None):
+    # Parse once (through the expression cache), then evaluate over all samples
+    compiled = compile_expression(expr)
+    return evaluate_program_vectorized(compiled['dag'] or compiled['optimized'], bindings, scope)
+
+def _finite_list(values):
+    # inf and NaN (e.g. from a product that overflows, as in the scalar path)
+    # become null, since JSON has no literal for them
+    if np.isfinite(values).all():
+        return values.tolist()
+    return np.where(np.isfinite(values), values, None).tolist()
+
+def to_json(values):
+    # Real results as a list, complex results as separate re/im lists
+    if np.iscomplexobj(values):
+        return {'re': _finite_list(values.real), 'im': _finite_list(values.imag)}
+    return _finite_list(values)
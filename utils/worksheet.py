@@ -0,0 +1,248 @@
+import os
+import threading
+import time
+
+import utils.dag as dag
+import utils.metrics as metrics
+import utils.parser as parser
+from utils.cache import compile_expression
+from utils.jsonutil import json_value
+from utils.scopes import DEFAULT_SCOPE, scope_store
+
+__all__ = ['Worksheet', 'worksheets', 'define_cells', 'remove_cell', 'variables_changed', 'describe']
+
+# Reactive worksheets: named expressions ("cells") whose values are kept in
+# the session's variables. Each cell depends on the variables its program
+# reads; when a variable or cell changes, only the cells downstream of it
+# are re-evaluated, in topological order.
+
+# Seconds before an idle session's worksheet is dropped, as for its variables
+WORKSHEET_TTL = float(os.environ.get('VARIABLE_TTL', 3600))
+
+_recomputed = 0
+
+def _cell_name(name):
+    name = str(name).strip()
+    try:
+        kind = parser.token_kind(name)
+    except ValueError:
+        kind = None
+    if kind != 'var':
+        raise ValueError(f'Invalid cell name: {name}')
+    return name
+
+class Worksheet:
+    def __init__(self):
+        self.cells = {}         # name -> {'expression', 'compiled', 'deps'}
+        self.dependents = {}    # variable or cell name -> cells that read it
+        self.errors = {}        # cell name -> error from its last evaluation
+        self.lock = threading.Lock()
+
+    def _link(self, name, cell):
+        self.cells[name] = cell
+        for dep in cell['deps']:
+            self.dependents.setdefault(dep, set()).add(name)
+
+    def _unlink(self, name):
+        cell = self.cells.pop(name, None)
+        if cell is None:
+            return None
+        for dep in cell['deps']:
+            readers = self.dependents.get(dep)
+            if readers is not None:
+                readers.discard(name)
+                if not readers:
+                    del self.dependents[dep]
+        self.errors.pop(name, None)
+        return cell
+
+    def affected(self, names):
+        # Cells downstream of names, plus any of names that are cells
+        seen = {name for name in names if name in self.cells}
+        stack = list(names)
+        while stack:
+            for reader in self.dependents.get(stack.pop(), ()):
+                if reader not in seen:
+                    seen.add(reader)
+                    stack.append(reader)
+        return seen
+
+    def order(self, names):
+        # Kahn's algorithm over the cells in names; whatever never becomes
+        # ready is on a cycle
+        pending = {name: sum(1 for dep in self.cells[name]['deps'] if dep in names) for name in names}
+        ready = sorted((name for name, count in pending.items() if not count), reverse=True)
+        order = []
+        while ready:
+            name = ready.pop()
+            order.append(name)
+            for reader in self.dependents.get(name, ()):
+                if reader in pending:
+                    pending[reader] -= 1
+                    if not pending[reader]:
+                        ready.append(reader)
+        if len(order) < len(names):
+            # Peel off cells that are only downstream of the cycle
+            stuck = set(names) - set(order)
+            while True:
+                tail = {name for name in stuck if not self.dependents.get(name, set()) & stuck}
+                if not tail:
+                    break
+                stuck -= tail
+            raise ValueError(f'Circular reference between cells: {", ".join(sorted(stuck))}')
+        return order
+
+    def define(self, cells):
+        # Adds or replaces {name: expression}; rolls back if that makes a cycle.
+        # Returns the cells to recompute, in order.
+        compiled = {}
+        for name, expression in cells.items():
+            program = compile_expression(expression)
+            if program['assign_var']:
+                raise ValueError(f'Cell {name} cannot contain an assignment')
+            compiled[_cell_name(name)] = {
+                'expression': str(expression).strip(),
+                'compiled': program,
+                'deps': frozenset(value for opcode, _, value in program['program'] if opcode == 'var')
+            }
+        previous = {name: self._unlink(name) for name in compiled}
+        for name, cell in compiled.items():
+            self._link(name, cell)
+        try:
+            return self.order(self.affected(compiled))
+        except ValueError:
+            for name, cell in previous.items():
+                self._unlink(name)
+                if cell is not None:
+                    self._link(name, cell)
+            raise
+
+    def remove(self, names):
+        # Forgets the formulas of names (they become plain variables, or go
+        # away); returns the downstream cells to recompute, in order
+        removed = [name for name in names if self._unlink(name) is not None]
+        return self.order(self.affected(names)), removed
+
+    def recompute(self, order, scope):
+        # Evaluates cells in order against scope (updated in place with each
+        # result); returns ({name: value}, {name: error})
+        global _recomputed
+        values = {}
+        errors = {}
+        with metrics.stage('worksheet_recompute'):
+            for name in order:
+                try:
+                    result = dag.evaluate(self.cells[name]['compiled'], scope)
+                except Exception as e:
+                    scope.pop(name, None)
+                    errors[name] = str(e)
+                else:
+                    scope[name] = result
+                    values[name] = result
+        _recomputed += len(order)
+        for name in order:
+            self.errors.pop(name, None)
+        self.errors.update(errors)
+        return values, errors
+
+class _WorksheetStore:
+    # Worksheets by session token, dropped after WORKSHEET_TTL idle seconds
+    # (the default scope's is kept). Held in this process only.
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._sheets = {}
+        self._access = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + ttl
+
+    def get(self, scope_id, create=True):
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._next_sweep = now + min(self.ttl, 60)
+                for stale in [s for s, t in self._access.items() if t < now - self.ttl and s != DEFAULT_SCOPE]:
+                    del self._sheets[stale], self._access[stale]
+            sheet = self._sheets.get(scope_id)
+            if sheet is None:
+                if not create:
+                    return None
+                sheet = self._sheets[scope_id] = Worksheet()
+            self._access[scope_id] = now
+            return sheet
+
+    def __len__(self):
+        return len(self._sheets)
+
+    def cells(self):
+        with self._lock:
+            return sum(len(sheet.cells) for sheet in self._sheets.values())
+
+worksheets = _WorksheetStore(WORKSHEET_TTL)
+
+@metrics.register_collector
+def _worksheet_metrics():
+    return [
+        ('worksheet_sessions', 'gauge', 'Sessions with a worksheet.', len(worksheets)),
+        ('worksheet_cells', 'gauge', 'Worksheet cells across sessions.', worksheets.cells()),
+        ('worksheet_recomputed_total', 'counter', 'Worksheet cells re-evaluated.', _recomputed)
+    ]
+
+def _publish(sheet, scope_id, order):
+    # Recomputes order and writes the results into the session's variables;
+    # cells that failed are removed from them
+    scope = dict(scope_store.snapshot(scope_id))
+    values, errors = sheet.recompute(order, scope)
+    for name, value in values.items():
+        scope_store.set(scope_id, name, value)
+    for name in errors:
+        scope_store.delete(scope_id, name)
+    return {
+        'updated': {name: json_value(value) for name, value in values.items()},
+        'errors': errors,
+        'order': order
+    }
+
+def define_cells(scope_id, cells):
+    sheet = worksheets.get(scope_id)
+    with sheet.lock:
+        return _publish(sheet, scope_id, sheet.define(cells))
+
+def remove_cell(scope_id, name):
+    # Deletes a cell and its value; cells that read it are recomputed (and fail)
+    sheet = worksheets.get(scope_id)
+    with sheet.lock:
+        if name not in sheet.cells:
+            raise ValueError(f'Unknown cell: {name}')
+        order, _ = sheet.remove([name])
+        scope_store.delete(scope_id, name)
+        return _publish(sheet, scope_id, order)
+
+def variables_changed(scope_id, names):
+    # Call after names were assigned or deleted outside the worksheet. An
+    # assigned cell loses its formula, as when typing over a spreadsheet cell.
+    # Returns the recomputation, or None if nothing depends on names.
+    sheet = worksheets.get(scope_id, create=False)
+    if sheet is None:
+        return None
+    with sheet.lock:
+        order, removed = sheet.remove(names)
+        if not order and not removed:
+            return None
+        return _publish(sheet, scope_id, order)
+
+def describe(scope_id):
+    # Every cell with its expression, dependencies and current value or error
+    sheet = worksheets.get(scope_id)
+    scope = scope_store.snapshot(scope_id)
+    with sheet.lock:
+        order = sheet.order(set(sheet.cells))
+        cells = {}
+        for name in order:
+            cell = sheet.cells[name]
+            entry = {'expression': cell['expression'], 'depends_on': sorted(cell['deps'])}
+            if name in sheet.errors:
+                entry['error'] = sheet.errors[name]
+            else:
+                entry['value'] = json_value(scope.get(name))
+            cells[name] = entry
+    return {'cells': cells, 'order': order}